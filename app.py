@@ -1,11 +1,57 @@
 import streamlit as st
+import hashlib
 import os
 import time
-from config import PAPERS_DIR
-from ingest_pdfs import extract_chunks_from_pdf
+from config import DEFAULT_WORKSPACE, DEBUG
+from workspaces import get_workspace, list_workspaces
+from ingest_pdfs import extract_chunks_from_pdf, find_source_by_hash
 from semantic_retrieval import retrieve_chunks, precompute_embeddings
 from llm_answer import generate_structured_report, GEMINI_AVAILABLE
-from pdf_export import create_pdf_report
+from pdf_export import render_pdf_report
+from warmup import start_background_warmup, format_report
+from paper_digest import answer_from_digests
+from memory_profile import format_report as format_memory_report
+
+@st.cache_resource(show_spinner=False)
+def _background_warmup():
+    """Runs once per server process: loads the model and heavy imports off the request path."""
+    return start_background_warmup()
+
+def _create_workspace():
+    """Creates the workspace typed into the sidebar and selects it. Runs before the widgets are redrawn."""
+    name = st.session_state.new_workspace.strip()
+    try:
+        get_workspace(name)
+    except ValueError as e:
+        st.session_state.workspace_error = str(e)
+        return
+    st.session_state.workspace = name
+    st.session_state.new_workspace = ""
+
+def show_answer(answer, caption):
+    """Displays an answer in the styled container with its PDF download button."""
+    st.markdown('<div class="answer-container">', unsafe_allow_html=True)
+    st.markdown("<h3 style='color: var(--primary-color); margin-bottom: 1rem;'>📝 Generated Answer</h3>", unsafe_allow_html=True)
+
+    # Add source information
+    st.markdown(f"<p style='color: var(--text-secondary); font-style: italic; margin-bottom: 1rem;'>{caption}</p>", unsafe_allow_html=True)
+
+    st.markdown(answer)
+    st.markdown('</div>', unsafe_allow_html=True)
+
+    # Download button
+    # The report is rendered in memory only after the answer is shown,
+    # and memoized so the download rerun doesn't render it again
+    st.markdown('<div style="text-align: center; margin: 2rem 0;">', unsafe_allow_html=True)
+    st.download_button(
+        label="📥 Download Research Report (PDF)",
+        data=render_pdf_report(answer),
+        file_name="research_report.pdf",
+        mime="application/pdf",
+        help="Download the generated research report as PDF",
+        use_container_width=True
+    )
+    st.markdown('</div>', unsafe_allow_html=True)
 
 def main():
     # Set page config with professional styling
@@ -15,6 +61,7 @@ def main():
         layout="wide",
         initial_sidebar_state="expanded"
     )
+    _background_warmup()
 
     # Custom CSS for advanced styling with animations
     st.markdown("""
@@ -302,6 +349,17 @@ def main():
             st.warning("⚠️ Google Gemini library not installed. Running in fallback mode.", icon="⚠️")
             st.markdown("**Installation required:** `pip install google-generativeai`", unsafe_allow_html=True)
 
+        # Each workspace has its own papers and index; the embedding model is shared.
+        # Only existing workspaces can be selected; new ones are created explicitly.
+        workspace_name = st.selectbox("📁 Workspace", list_workspaces(), key="workspace",
+                                      help="Documents and questions are scoped to this workspace")
+        with st.expander("New workspace"):
+            st.text_input("Name", key="new_workspace", help="Letters, digits, '-' and '_'")
+            st.button("Create", on_click=_create_workspace)
+            if "workspace_error" in st.session_state:
+                st.error(st.session_state.pop("workspace_error"))
+        workspace = get_workspace(workspace_name or DEFAULT_WORKSPACE)
+
         # Add system info
         st.markdown('---')
         st.markdown('**System Information**')
@@ -309,8 +367,11 @@ def main():
         st.markdown(f'**LLM:** {"Google Gemini" if GEMINI_AVAILABLE else "Fallback Mode"}')
         st.markdown(f'**Version:** 1.0.0')
 
-    # Ensure directories
-    os.makedirs(PAPERS_DIR, exist_ok=True)
+        if DEBUG:
+            with st.expander("Startup timings"):
+                st.code(format_report())
+            with st.expander("Memory by stage"):
+                st.code(format_memory_report())
 
     # Initialize session state
     if 'processing_complete' not in st.session_state:
@@ -356,10 +417,13 @@ def main():
                     total_files = len(uploaded_files)
                     
                     for i, file in enumerate(uploaded_files):
-                        path = os.path.join(PAPERS_DIR, file.name)
-                        with open(path, "wb") as f:
-                            f.write(file.getbuffer())
-                        extract_chunks_from_pdf(path)
+                        data = file.getbuffer()
+                        # Identical content (even under another name) is already indexed
+                        if find_source_by_hash(hashlib.sha256(data).hexdigest(), workspace) is None:
+                            path = os.path.join(workspace.papers_dir, file.name)
+                            with open(path, "wb") as f:
+                                f.write(data)
+                            extract_chunks_from_pdf(path, workspace)
                         progress_bar.progress((i + 1) / total_files)
                         time.sleep(0.1)  # Small delay for animation
                     
@@ -367,7 +431,7 @@ def main():
                     time.sleep(0.5)  # Small delay for animation
                     
                     try:
-                        precompute_embeddings()
+                        precompute_embeddings(workspace)
                         st.session_state.processing_complete = True
                         st.session_state.current_step = "question"
                         st.session_state.show_welcome = False
@@ -433,7 +497,13 @@ def main():
         
         with col_btn1:
             if st.button("🤖 Generate Answer", key="generate_btn", help="Generate answer based on uploaded documents"):
-                if not api_key or api_key == "fallback_mode":
+                # Overview, listing and "which paper mentions X" questions are
+                # answered from the precomputed digests without calling the LLM
+                digest_answer = answer_from_digests(question, workspace) if question.strip() else None
+                if digest_answer:
+                    st.session_state.answer_generated = True
+                    show_answer(digest_answer, "Answered instantly from the precomputed paper digests")
+                elif not api_key or api_key == "fallback_mode":
                     st.error("❌ Please enter your Google Gemini API Key in the sidebar.", icon="🔑")
                 elif not question.strip():
                     st.warning("⚠️ Please enter a question.", icon="❓")
@@ -446,7 +516,7 @@ def main():
                         time.sleep(1)
                         
                         # Retrieve
-                        chunks = retrieve_chunks(question)
+                        chunks = retrieve_chunks(question, workspace=workspace)
                         
                         if not chunks:
                             st.warning("⚠️ No relevant information found in documents. Try a different question.", icon="🔍")
@@ -457,41 +527,12 @@ def main():
                             # Answer
                             answer = generate_structured_report(question, chunks, api_key)
                             
-                            progress_text.markdown('<div class="info-box">📄 <strong>Creating research report...</strong></div>', unsafe_allow_html=True)
-                            time.sleep(0.5)
-                            
-                            # Generate PDF
-                            pdf_filename = "research_report.pdf"
-                            create_pdf_report(answer, filename=pdf_filename)
-                            
                             st.session_state.answer_generated = True
                             
                             # Clear progress text and show answer
                             progress_text.empty()
                             
-                            # Display answer in a styled container
-                            st.markdown('<div class="answer-container">', unsafe_allow_html=True)
-                            st.markdown("<h3 style='color: var(--primary-color); margin-bottom: 1rem;'>📝 Generated Answer</h3>", unsafe_allow_html=True)
-                            
-                            # Add source information
-                            st.markdown(f"<p style='color: var(--text-secondary); font-style: italic; margin-bottom: 1rem;'>Based on {len(chunks)} relevant document chunks</p>", unsafe_allow_html=True)
-                            
-                            st.markdown(answer)
-                            st.markdown('</div>', unsafe_allow_html=True)
-                            
-                            # Download button
-                            if os.path.exists(pdf_filename):
-                                st.markdown('<div style="text-align: center; margin: 2rem 0;">', unsafe_allow_html=True)
-                                with open(pdf_filename, "rb") as f:
-                                    st.download_button(
-                                        label="📥 Download Research Report (PDF)",
-                                        data=f,
-                                        file_name=pdf_filename,
-                                        mime="application/pdf",
-                                        help="Download the generated research report as PDF",
-                                        use_container_width=True
-                                    )
-                                st.markdown('</div>', unsafe_allow_html=True)
+                            show_answer(answer, f"Based on {len(chunks)} relevant document chunks")
                                 
         with col_btn2:
             if st.button("🔄 Reset Processing", help="Reset document processing status", type="secondary"):
@@ -0,0 +1,55 @@
+"""
+Atomic file replacement for everything that rewrites corpus files.
+
+Every writer gets its own temp file from tempfile.mkstemp in the target's
+directory, so concurrent writers in one process (Streamlit sessions,
+query_server threads) never share or delete each other's temp files, and
+readers only ever see the complete old file or the complete new one.
+"""
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+
+# mkstemp creates files as 0600; give replaced files the usual permissions
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+@contextmanager
+def atomic_path(path):
+    """
+    Yields a fresh temp path next to `path`. When the block succeeds the temp
+    file replaces `path`; when it raises, the temp file is removed.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                    prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    os.close(fd)
+    try:
+        yield tmp_path
+        os.chmod(tmp_path, 0o666 & ~_UMASK)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+@contextmanager
+def atomic_write(path, mode="w"):
+    """Like open(path, mode) for writing, but the file only appears at path once closed."""
+    with atomic_path(path) as tmp_path:
+        with open(tmp_path, mode, encoding=None if "b" in mode else "utf-8") as f:
+            yield f
+
+
+def write_json_atomic(path, data, indent=None):
+    with atomic_write(path) as f:
+        json.dump(data, f, indent=indent)
+
+
+def write_bytes_atomic(path, data):
+    with atomic_write(path, "wb") as f:
+        f.write(data)
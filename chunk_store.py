@@ -0,0 +1,405 @@
+"""
+Columnar, append-only storage for a workspace's chunks.
+
+All chunk texts live in one UTF-8 buffer addressed by an offsets array, and
+the repeated source/section/type strings are interned into small tables
+referenced by integer arrays. Loading and holding the corpus therefore costs
+roughly the size of the raw data instead of several Python objects per chunk.
+Dict-like ChunkView objects are only created for the results actually
+returned.
+
+On disk every column is a raw file in a directory next to chunks.json
+(chunks.columns/), and meta.json records the row count, the byte length of
+each column and the string tables. Ingest appends rows to the column files
+and then atomically replaces meta.json, so readers, which only read as far as
+meta.json says, never see a partial append, and adding a paper costs only the
+size of that paper. Removing rows rewrites the columns as a new generation.
+A chunks.json from before this format is converted once, on first use.
+"""
+import json
+import os
+from collections.abc import Mapping
+import numpy as np
+from atomic_io import atomic_write, write_json_atomic
+from workspaces import file_lock
+
+_FIELDS = ("chunk_id", "source", "section", "type", "text", "page")
+
+_COLUMNS = {
+    "text_buf": np.uint8, "text_offsets": np.int64,
+    "id_buf": np.uint8, "id_offsets": np.int64,
+    "source_idx": np.int32, "section_idx": np.int32,
+    "type_idx": np.int32, "page": np.int32,
+}
+
+
+class ChunkView(Mapping):
+    """Read-only, dict-like view of one chunk, plus an optional retrieval score."""
+
+    __slots__ = ("_store", "_i", "score")
+
+    def __init__(self, store, i, score=None):
+        self._store = store
+        self._i = i
+        self.score = score
+
+    def __getitem__(self, key):
+        if key == "score" and self.score is not None:
+            return self.score
+        if key not in _FIELDS:
+            raise KeyError(key)
+        value = self._store.field(key, self._i)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        for key in _FIELDS:
+            if key != "page" or self._store.page[self._i] >= 0:
+                yield key
+        if self.score is not None:
+            yield "score"
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def copy(self):
+        return dict(self)
+
+    def __repr__(self):
+        return f"ChunkView({self['chunk_id']!r})"
+
+
+def _intern(values, table=None):
+    """Integer ids for values, extending `table` (an existing list of values) in place."""
+    table = [] if table is None else table
+    lookup = {value: i for i, value in enumerate(table)}
+    ids = np.empty(len(values), dtype=np.int32)
+    for i, value in enumerate(values):
+        if value not in lookup:
+            lookup[value] = len(table)
+            table.append(value)
+        ids[i] = lookup[value]
+    return table, ids
+
+
+def _pack(strings, base=0):
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.full(len(encoded) + 1, base, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    offsets[1:] += base
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def _take_strings(buf, offsets, rows):
+    """The buffer and zero-based offsets holding only the strings of `rows` (sorted)."""
+    starts, ends = offsets[rows], offsets[rows + 1]
+    new_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(ends - starts, out=new_offsets[1:])
+    if not len(rows):
+        return np.empty(0, dtype=np.uint8), new_offsets
+    # Consecutive rows are adjacent in the buffer, so each run is copied in one slice
+    breaks = np.flatnonzero(rows[1:] != rows[:-1] + 1) + 1
+    first, last = np.r_[0, breaks], np.r_[breaks - 1, len(rows) - 1]
+    new_buf = np.concatenate([buf[s:e] for s, e in zip(starts[first], ends[last])])
+    return new_buf, new_offsets
+
+
+class ChunkStore:
+    """Columnar chunk metadata and text. Index with store[i] to get a ChunkView."""
+
+    def __init__(self, arrays, tables):
+        self.text_buf = arrays["text_buf"]
+        self.text_offsets = arrays["text_offsets"]
+        self.id_buf = arrays["id_buf"]
+        self.id_offsets = arrays["id_offsets"]
+        self.source_idx = arrays["source_idx"]
+        self.section_idx = arrays["section_idx"]
+        self.type_idx = arrays["type_idx"]
+        self.page = arrays["page"]
+        self.sources = tables["sources"]
+        self.sections = tables["sections"]
+        self.types = tables["types"]
+
+    @classmethod
+    def from_dicts(cls, chunks, tables=None, text_base=0, id_base=0):
+        """
+        Builds a store from chunk dicts (or ChunkViews). With `tables` and byte
+        bases from an existing store, the result holds rows to append to it:
+        strings are interned into copies of those tables and offsets continue
+        from the bases.
+        """
+        tables = tables or {}
+        text_buf, text_offsets = _pack([c["text"] for c in chunks], text_base)
+        id_buf, id_offsets = _pack([c["chunk_id"] for c in chunks], id_base)
+        sources, source_idx = _intern([c["source"] for c in chunks], list(tables.get("sources", [])))
+        sections, section_idx = _intern([c.get("section", "Unknown") for c in chunks], list(tables.get("sections", [])))
+        types, type_idx = _intern([c.get("type", "text") for c in chunks], list(tables.get("types", [])))
+        page = np.fromiter((c.get("page", -1) for c in chunks), dtype=np.int32, count=len(chunks))
+        arrays = {
+            "text_buf": text_buf, "text_offsets": text_offsets,
+            "id_buf": id_buf, "id_offsets": id_offsets,
+            "source_idx": source_idx, "section_idx": section_idx,
+            "type_idx": type_idx, "page": page,
+        }
+        return cls(arrays, {"sources": sources, "sections": sections, "types": types})
+
+    def __len__(self):
+        return len(self.source_idx)
+
+    def __getitem__(self, i):
+        return ChunkView(self, i)
+
+    def __iter__(self):
+        return (ChunkView(self, i) for i in range(len(self)))
+
+    def view(self, i, score=None):
+        return ChunkView(self, i, score)
+
+    def text(self, i):
+        return self.text_buf[self.text_offsets[i]:self.text_offsets[i + 1]].tobytes().decode("utf-8")
+
+    def chunk_id(self, i):
+        return self.id_buf[self.id_offsets[i]:self.id_offsets[i + 1]].tobytes().decode("utf-8")
+
+    def field(self, key, i):
+        if key == "text":
+            return self.text(i)
+        if key == "chunk_id":
+            return self.chunk_id(i)
+        if key == "source":
+            return self.sources[self.source_idx[i]]
+        if key == "section":
+            return self.sections[self.section_idx[i]]
+        if key == "type":
+            return self.types[self.type_idx[i]]
+        if key == "page":
+            page = int(self.page[i])
+            return page if page >= 0 else None
+        raise KeyError(key)
+
+    @property
+    def nbytes(self):
+        size = sum(a.nbytes for a in (
+            self.text_buf, self.text_offsets, self.id_buf, self.id_offsets,
+            self.source_idx, self.section_idx, self.type_idx, self.page,
+        ))
+        return size + sum(len(s) for s in self.sources + self.sections + self.types)
+
+    def arrays(self):
+        return {name: getattr(self, name) for name in _COLUMNS}
+
+    def tables(self):
+        return {"sources": self.sources, "sections": self.sections, "types": self.types}
+
+    def take(self, rows):
+        """
+        A new store with only `rows` (sorted row numbers), sliced from the
+        columns without decoding a string. Offsets restart at zero and the
+        tables keep only the strings still referenced.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        arrays = {"page": self.page[rows]}
+        arrays["text_buf"], arrays["text_offsets"] = _take_strings(self.text_buf, self.text_offsets, rows)
+        arrays["id_buf"], arrays["id_offsets"] = _take_strings(self.id_buf, self.id_offsets, rows)
+        tables = {}
+        for column, table in (("source_idx", "sources"), ("section_idx", "sections"), ("type_idx", "types")):
+            used, remapped = np.unique(getattr(self, column)[rows], return_inverse=True)
+            arrays[column] = remapped.reshape(-1).astype(np.int32)
+            tables[table] = [getattr(self, table)[i] for i in used]
+        return ChunkStore(arrays, tables)
+
+
+def store_dir(chunks_file):
+    """Directory holding the column files for the corpus at chunks_file."""
+    return os.path.splitext(chunks_file)[0] + ".columns"
+
+
+def _meta_path(chunks_file):
+    return os.path.join(store_dir(chunks_file), "meta.json")
+
+
+def _column_path(chunks_file, name, generation):
+    return os.path.join(store_dir(chunks_file), f"{name}.{generation}")
+
+
+def _column_lengths(meta):
+    rows = meta["rows"]
+    return {
+        "text_buf": meta["text_bytes"], "text_offsets": rows + 1,
+        "id_buf": meta["id_bytes"], "id_offsets": rows + 1,
+        "source_idx": rows, "section_idx": rows, "type_idx": rows, "page": rows,
+    }
+
+
+def _read_meta(chunks_file):
+    try:
+        with open(_meta_path(chunks_file), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _current_meta(chunks_file):
+    """The store's metadata, converting a legacy chunks.json first if needed. None if there is no corpus."""
+    meta = _read_meta(chunks_file)
+    if meta is not None or not os.path.exists(chunks_file):
+        return meta
+    # Under the workspace lock (the same .lock file), so a concurrent ingest can't be overwritten
+    with file_lock(os.path.join(os.path.dirname(chunks_file), ".lock")):
+        meta = _read_meta(chunks_file)
+        if meta is None:
+            try:
+                with open(chunks_file, "r", encoding="utf-8") as f:
+                    chunks = json.load(f)
+            except json.JSONDecodeError:
+                print("Warning: chunks.json was corrupted. Ignoring it.")
+                chunks = []
+            write_chunk_store(chunks, chunks_file)
+            del chunks
+            legacy_npz = os.path.splitext(chunks_file)[0] + ".npz"
+            if os.path.exists(legacy_npz):
+                os.remove(legacy_npz)
+            meta = _read_meta(chunks_file)
+    return meta
+
+
+def store_version(chunks_file):
+    """
+    Identifies the stored corpus state by the modification time and size of
+    meta.json, which is replaced on every change. None if there is no corpus.
+    """
+    try:
+        st = os.stat(_meta_path(chunks_file))
+    except FileNotFoundError:
+        if _current_meta(chunks_file) is None:
+            return None
+        st = os.stat(_meta_path(chunks_file))
+    return (st.st_mtime_ns, st.st_size)
+
+
+def stored_sources(chunks_file):
+    """Names of the sources that have rows in the store, read from its metadata alone."""
+    meta = _current_meta(chunks_file)
+    return set(meta["sources"]) if meta else set()
+
+
+def _map_column(path, dtype, length):
+    """Read-only memory map of the first `length` items of a column file."""
+    # np.memmap can't map zero bytes; a file that is too short is reported as truncated by the caller
+    if not length or os.path.getsize(path) < length * np.dtype(dtype).itemsize:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(length,))
+
+
+def load_chunk_store(chunks_file, retries=3, mmap=False):
+    """
+    Returns the ChunkStore for the corpus at chunks_file, reading each column
+    only as far as meta.json says. With mmap=True the columns are mapped
+    rather than read, for one-off scans that shouldn't hold the corpus in RAM;
+    a later remove only unlinks the old generation, so the maps stay valid.
+    Returns None if there is no corpus.
+    """
+    for attempt in range(retries):
+        meta = _current_meta(chunks_file)
+        if meta is None:
+            return None
+        try:
+            arrays = {}
+            for name, length in _column_lengths(meta).items():
+                path = _column_path(chunks_file, name, meta["generation"])
+                if mmap:
+                    arrays[name] = _map_column(path, _COLUMNS[name], length)
+                else:
+                    arrays[name] = np.fromfile(path, dtype=_COLUMNS[name], count=length)
+                if len(arrays[name]) != length:
+                    raise ValueError(f"Column {name} of {store_dir(chunks_file)} is truncated.")
+            return ChunkStore(arrays, meta)
+        except FileNotFoundError:
+            # Rewritten as a new generation between reading meta.json and the columns
+            if attempt == retries - 1:
+                raise
+
+
+def write_chunk_store(chunks, chunks_file):
+    """
+    Replaces the stored corpus with `chunks` (a ChunkStore, or chunk dicts),
+    writing the columns as a new generation so concurrent readers of the old
+    one are unaffected. Callers hold the workspace lock.
+    """
+    store = chunks if isinstance(chunks, ChunkStore) else ChunkStore.from_dicts(chunks)
+    old = _read_meta(chunks_file)
+    generation = old["generation"] + 1 if old else 1
+    os.makedirs(store_dir(chunks_file), exist_ok=True)
+    for name, array in store.arrays().items():
+        with atomic_write(_column_path(chunks_file, name, generation), "wb") as f:
+            np.ascontiguousarray(array, dtype=_COLUMNS[name]).tofile(f)
+    meta = {
+        "generation": generation, "rows": len(store),
+        "text_bytes": int(store.text_offsets[-1]), "id_bytes": int(store.id_offsets[-1]),
+        "sources": store.sources, "sections": store.sections, "types": store.types,
+    }
+    write_json_atomic(_meta_path(chunks_file), meta)
+
+    suffix = f".{generation}"
+    for name in os.listdir(store_dir(chunks_file)):
+        if name.split(".")[0] in _COLUMNS and not name.endswith(suffix):
+            try:
+                os.remove(os.path.join(store_dir(chunks_file), name))
+            except FileNotFoundError:
+                pass
+
+
+def append_chunks(chunks, chunks_file):
+    """
+    Appends chunk dicts to the stored corpus without rewriting existing rows.
+    Callers hold the workspace lock.
+    """
+    meta = _current_meta(chunks_file)
+    if meta is None:
+        write_chunk_store(chunks, chunks_file)
+        return
+    if not chunks:
+        return
+
+    new = ChunkStore.from_dicts(chunks, meta, meta["text_bytes"], meta["id_bytes"])
+    arrays = new.arrays()
+    # Offsets continue from the last stored one, which is already on disk
+    arrays["text_offsets"] = arrays["text_offsets"][1:]
+    arrays["id_offsets"] = arrays["id_offsets"][1:]
+    for name, length in _column_lengths(meta).items():
+        with open(_column_path(chunks_file, name, meta["generation"]), "r+b") as f:
+            # Drops whatever an interrupted append left past the committed length
+            f.truncate(length * np.dtype(_COLUMNS[name]).itemsize)
+            f.seek(0, os.SEEK_END)
+            np.ascontiguousarray(arrays[name], dtype=_COLUMNS[name]).tofile(f)
+
+    meta = dict(meta, rows=meta["rows"] + len(new), text_bytes=int(new.text_offsets[-1]),
+                id_bytes=int(new.id_offsets[-1]), sources=new.sources, sections=new.sections, types=new.types)
+    # The append becomes visible only here
+    write_json_atomic(_meta_path(chunks_file), meta)
+
+
+def remove_sources(sources, chunks_file, new_chunks=()):
+    """
+    Rewrites the stored corpus without the rows of `sources`, plus
+    `new_chunks` at the end. Returns the number of rows removed.
+    """
+    store = load_chunk_store(chunks_file)
+    if store is None:
+        write_chunk_store(list(new_chunks), chunks_file)
+        return 0
+    dropped = np.array([source in sources for source in store.sources], dtype=bool)
+    keep = np.flatnonzero(~dropped[store.source_idx])
+    kept = store.take(keep)
+    if new_chunks:
+        added = ChunkStore.from_dicts(list(new_chunks), kept.tables(),
+                                      int(kept.text_offsets[-1]), int(kept.id_offsets[-1]))
+        arrays = added.arrays()
+        # The added offsets continue from the last kept one
+        arrays["text_offsets"] = arrays["text_offsets"][1:]
+        arrays["id_offsets"] = arrays["id_offsets"][1:]
+        kept = ChunkStore({name: np.concatenate([column, arrays[name]]) for name, column in kept.arrays().items()},
+                          added.tables())
+    write_chunk_store(kept, chunks_file)
+    return len(store) - len(keep)
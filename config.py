@@ -6,13 +6,25 @@ MEMORY_DIR = os.path.join(BASE_DIR, "memory")
 PAPERS_DIR = os.path.join(BASE_DIR, "papers")
 CHUNKS_FILE = os.path.join(MEMORY_DIR, "chunks.json")
 EMBED_FILE = os.path.join(MEMORY_DIR, "chunk_embeddings.npy")
+EMBED_IDS_FILE = os.path.join(MEMORY_DIR, "chunk_embedding_ids.json")  # text hash per embedding row
+SOURCES_FILE = os.path.join(MEMORY_DIR, "sources.json")  # content hash per ingested PDF
+DIGESTS_FILE = os.path.join(MEMORY_DIR, "digests.json")  # per-paper digests and keyword index
+EXTRACT_CACHE_DIR = os.path.join(MEMORY_DIR, "extract_cache")  # per-page text keyed by PDF SHA-256
 
 # Ensure directories exist
 os.makedirs(MEMORY_DIR, exist_ok=True)
 os.makedirs(PAPERS_DIR, exist_ok=True)
+os.makedirs(EXTRACT_CACHE_DIR, exist_ok=True)
+
+# Workspaces
+DEFAULT_WORKSPACE = "default"  # uses the paths above
+WORKSPACES_DIR = os.path.join(MEMORY_DIR, "workspaces")  # <name>/ holds each other workspace's corpus
+INDEX_CACHE_BUDGET_MB = 1024  # RAM for hot workspace indexes; larger ones are memory-mapped
 
 # Retrieval
 TOP_K = 5
+EXACT_SEARCH_BLOCK_ROWS = 65536  # embedding rows scored per block by exact_search
+EXACT_SEARCH_WORKERS = os.cpu_count() or 4
 
 # LLM
 LLM_MODEL = "models/gemini-flash-latest"  # Latest available free flash model
@@ -21,13 +33,53 @@ LLM_MAX_TOKENS = 1500
 
 # Embeddings
 EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+EMBED_BATCH_SIZE = 64  # starting encode batch size; adapted to MEMORY_BUDGET_MB
+
+# Memory
+MEMORY_BUDGET_MB = 2048  # anonymous (non-file-backed) memory that ingestion and embedding aim to stay under
 
 # Chunking
+CHUNK_MODE = "chars"  # "chars", or "tokens" to cut at the embedding model's max_seq_length
 CHUNK_SIZE = 1000  # characters
 CHUNK_OVERLAP = 200 # characters
+CHUNK_OVERLAP_TOKENS = 32  # overlap in "tokens" mode
+
+# Paper digests (extractive per-source summaries and keyword index built at ingest)
+DIGESTS_ENABLED = True
+DIGEST_KEY_SENTENCES = 5
+DIGEST_TOP_TERMS = 15
+DIGEST_INDEX_TERMS = 200  # most frequent terms per paper kept for "which papers mention ..." lookups
+DIGEST_MAX_TOPIC_TERMS = 6  # longer topics in "which papers mention ..." questions go to the LLM
+
+# Near-duplicate detection (preprint vs published versions, repeated boilerplate)
+NEAR_DUPLICATE_DETECTION = True
+NEAR_DUPLICATE_THRESHOLD = 0.85  # estimated Jaccard similarity of word shingles
+SHINGLE_SIZE = 5  # words per shingle
+MINHASH_PERMUTATIONS = 128
+LSH_BANDS = 16  # must divide MINHASH_PERMUTATIONS
+
+# Index bundles (index_bundle.py)
+BUNDLE_EMBED_DTYPE = "float32"  # or "float16" to halve bundle size at a small cost in score precision
+
+# Query service
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8765
+SERVER_WORKERS = 4        # threads for query encoding and scoring
+SERVER_QUEUE_SIZE = 32    # requests allowed to wait before returning 503
+SERVER_REQUEST_TIMEOUT = 60  # seconds
+
+# Sharded retrieval (sharded_retrieval.py)
+SHARD_COUNT = 4  # worker processes, each holding the vectors of the sources hashed to it
+SHARD_TIMEOUT = 5  # seconds a shard may take to answer before it counts as failed
+SHARD_ALLOW_PARTIAL = True  # answer from the remaining shards when one fails, rather than erroring
+SHARD_AUTHKEY = os.environ.get("RAG_SHARD_AUTHKEY", "").encode("utf-8")  # shared secret, required to serve or connect to shards over TCP
+
+# Watch-folder indexer (watch_indexer.py)
+WATCH_POLL_INTERVAL = 5  # seconds between directory scans
+WATCH_SETTLE_SECONDS = 10  # a file must be unchanged this long before it is ingested
 
 # Logging
-DEBUG = False  # Set to False for production
+DEBUG = False  # Set to False for production; also enables per-stage memory profiling
 
 # Application metadata
 APP_NAME = "Advanced RAG Academic Assistant"
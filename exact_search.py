@@ -0,0 +1,146 @@
+"""
+Exact (brute-force) top-k search over embedding matrices larger than RAM.
+
+The embeddings file is memory-mapped and scored in fixed-size row blocks on a
+thread pool; NumPy releases the GIL inside the matrix product, so blocks are
+scored in parallel. Each block keeps only its per-query top-k (argpartition)
+and the coordinator merges them into a running top-k, so memory stays bounded
+by roughly workers x block size regardless of corpus size.
+
+    python exact_search.py "which papers use Petri nets" --top-k 10 [--workspace NAME]
+"""
+import argparse
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+from config import TOP_K, EXACT_SEARCH_BLOCK_ROWS, EXACT_SEARCH_WORKERS
+from workspaces import get_workspace
+from chunk_store import load_chunk_store
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=EXACT_SEARCH_WORKERS, thread_name_prefix="exact-search")
+    return _executor
+
+
+def _top_k(indices, scores, k):
+    """Keeps the k highest scores per row of (indices, scores), unsorted."""
+    if scores.shape[1] <= k:
+        return indices, scores
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(indices, part, axis=1), np.take_along_axis(scores, part, axis=1)
+
+
+class BlockwiseSearcher:
+    """
+    Exact cosine top-k over a memory-mapped .npy embeddings file, or over any
+    array-like matrix (e.g. float16 rows mapped from an index bundle). Blocks
+    are converted to float32 before scoring; precomputed inverse row norms
+    are used when given.
+    """
+
+    def __init__(self, embeddings, block_rows=EXACT_SEARCH_BLOCK_ROWS, executor=None, workers=EXACT_SEARCH_WORKERS,
+                 inv_norms=None):
+        self.embeddings = np.load(embeddings, mmap_mode="r") if isinstance(embeddings, str) else embeddings
+        self.inv_norms = inv_norms
+        self.block_rows = block_rows
+        self.executor = executor or _get_executor()
+        self.workers = workers
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    def _score_block(self, start, queries, k):
+        block = np.asarray(self.embeddings[start:start + self.block_rows], dtype=np.float32)
+        if self.inv_norms is not None:
+            scores = (queries @ block.T) * self.inv_norms[start:start + len(block)]
+        else:
+            norms = np.linalg.norm(block, axis=1)
+            norms[norms == 0] = 1.0
+            scores = (queries @ block.T) / norms  # (num_queries, block rows)
+        indices = np.broadcast_to(np.arange(start, start + len(block), dtype=np.int64), scores.shape)
+        return _top_k(indices, scores, k)
+
+    def search(self, queries, top_k=TOP_K):
+        """
+        queries: (d,) or (num_queries, d) array. Returns (indices, scores), each
+        (num_queries, k), sorted by descending score.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        queries = queries / norms
+
+        n = len(self.embeddings)
+        k = min(top_k, n)
+        best_idx = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        if k <= 0:
+            return best_idx, best_scores
+
+        # Keep at most two blocks per worker in flight, so memory stays bounded
+        max_pending = 2 * self.workers
+        starts = iter(range(0, n, self.block_rows))
+        pending = set()
+        while True:
+            for start in starts:
+                pending.add(self.executor.submit(self._score_block, start, queries, k))
+                if len(pending) >= max_pending:
+                    break
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                idx, scores = future.result()
+                best_idx, best_scores = _top_k(
+                    np.concatenate([best_idx, idx], axis=1),
+                    np.concatenate([best_scores, scores], axis=1),
+                    k,
+                )
+
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        return np.take_along_axis(best_idx, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+
+def exact_retrieve_chunks(query, top_k=TOP_K, workspace=None):
+    """
+    Like semantic_retrieval.retrieve_chunks, but exact and without loading the
+    embeddings or the chunk columns into RAM. Never embeds: returns [] while the embeddings file
+    doesn't cover the chunks (e.g. mid-ingest).
+    """
+    from semantic_retrieval import encode_queries
+
+    ws = get_workspace(workspace)
+    # Only the returned rows are read from the mapped columns
+    chunks = load_chunk_store(ws.chunks_file, mmap=True)
+    if chunks is None or not len(chunks) or not os.path.exists(ws.embed_file):
+        return []
+
+    searcher = BlockwiseSearcher(ws.embed_file)
+    if len(searcher) != len(chunks):
+        return []
+    indices, scores = searcher.search(encode_queries([query]), top_k)
+    return [chunks.view(int(i), float(s)) for i, s in zip(indices[0], scores[0])]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exact top-k retrieval for audits.")
+    parser.add_argument("query")
+    parser.add_argument("--top-k", type=int, default=TOP_K)
+    parser.add_argument("--workspace", default=None)
+    args = parser.parse_args()
+
+    for rank, chunk in enumerate(exact_retrieve_chunks(args.query, args.top_k, args.workspace), 1):
+        print(f"{rank:>3}. {chunk['score']:.4f}  {chunk['source']}  {chunk['section']}")
+
+
+if __name__ == "__main__":
+    main()
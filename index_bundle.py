@@ -0,0 +1,392 @@
+"""
+Portable single-file index bundles for shipping a prebuilt corpus between machines.
+
+A bundle holds everything a workspace needs to answer queries: the columnar
+chunk metadata and text, the embeddings, the text hash of every embedding
+row, precomputed row norms, the sources manifest, the paper digests and the
+near-duplicate (MinHash) index, plus the embedding model name and chunking
+settings they were built with.
+
+Layout (little-endian):
+
+    b"RAGBUNDL" | section | section | ... | header JSON | u64 header length | header SHA-256 | b"RAGBUNDL"
+
+Every section starts on a 64-byte boundary and is described in the header by
+offset, length, SHA-256, compression and, for arrays, dtype and shape. The
+embeddings are stored uncompressed so they can be memory-mapped in place;
+everything else is zlib-compressed.
+
+    python index_bundle.py export corpus.ragb [--workspace NAME] [--dtype float16]
+    python index_bundle.py import corpus.ragb [--workspace NAME] [--no-verify]
+    python index_bundle.py info corpus.ragb
+"""
+import argparse
+import hashlib
+import json
+import os
+import struct
+import time
+import zlib
+import numpy as np
+from config import (
+    EMBEDDING_MODEL, BUNDLE_EMBED_DTYPE, INDEX_CACHE_BUDGET_MB, NEAR_DUPLICATE_DETECTION,
+    CHUNK_MODE, CHUNK_SIZE, CHUNK_OVERLAP, CHUNK_OVERLAP_TOKENS,
+)
+from workspaces import get_workspace, workspace_lock
+from chunk_store import ChunkStore, load_chunk_store, write_chunk_store, store_version
+from near_duplicates import NearDuplicateIndex, load_duplicate_index, duplicate_index_path
+from atomic_io import atomic_path, atomic_write, write_bytes_atomic
+
+MAGIC = b"RAGBUNDL"
+FORMAT_VERSION = 1
+_ALIGN = 64
+_TRAILER = struct.Struct("<Q32s8s")  # header length, header SHA-256, magic
+_CHUNK_ARRAYS = (
+    "text_buf", "text_offsets", "id_buf", "id_offsets",
+    "source_idx", "section_idx", "type_idx", "page",
+)
+_EMBED_DTYPES = ("float32", "float16")
+
+
+class BundleError(ValueError):
+    """Raised for corrupt, unreadable or incompatible bundles."""
+
+
+def _chunking_settings():
+    from ingest_pdfs import _chunking_tag
+    return {
+        "tag": _chunking_tag(), "mode": CHUNK_MODE, "size": CHUNK_SIZE,
+        "overlap": CHUNK_OVERLAP, "overlap_tokens": CHUNK_OVERLAP_TOKENS,
+    }
+
+
+def _read_file(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class _SectionWriter:
+    def __init__(self, f):
+        self.f = f
+        self.sections = {}
+
+    def _begin(self):
+        pad = -self.f.tell() % _ALIGN
+        self.f.write(b"\0" * pad)
+        return self.f.tell()
+
+    def add_bytes(self, name, data, compress=True, **meta):
+        offset = self._begin()
+        payload = zlib.compress(data, 6) if compress else data
+        self.f.write(payload)
+        self.sections[name] = {
+            "offset": offset, "length": len(payload), "sha256": hashlib.sha256(payload).hexdigest(),
+            "compression": "zlib" if compress else None, **meta,
+        }
+
+    def add_array(self, name, array, compress=True):
+        array = np.ascontiguousarray(array)
+        self.add_bytes(name, array.tobytes(), compress, dtype=array.dtype.str, shape=list(array.shape))
+
+    def add_rows(self, name, matrix, dtype, block_rows=65536):
+        """Streams a (possibly memory-mapped) matrix in row blocks, uncompressed."""
+        offset = self._begin()
+        digest = hashlib.sha256()
+        for start in range(0, len(matrix), block_rows):
+            block = np.ascontiguousarray(matrix[start:start + block_rows], dtype=dtype).tobytes()
+            digest.update(block)
+            self.f.write(block)
+        self.sections[name] = {
+            "offset": offset, "length": self.f.tell() - offset, "sha256": digest.hexdigest(),
+            "compression": None, "dtype": np.dtype(dtype).str, "shape": list(matrix.shape),
+        }
+
+
+def _duplicate_index(ws):
+    """(bytes of the workspace's MinHash index file, store version it is tagged with), refreshed if stale."""
+    path = duplicate_index_path(ws.chunks_file)
+    with workspace_lock(ws):
+        version = store_version(ws.chunks_file)
+        if NearDuplicateIndex.load(path, version) is None:
+            load_duplicate_index(ws.chunks_file).save(path, version)
+        return _read_file(path), version
+
+
+def export_bundle(path, workspace=None, dtype=BUNDLE_EMBED_DTYPE):
+    """
+    Writes the workspace's corpus to a bundle at path, embedding any chunks
+    that are not embedded yet first. Returns the bundle header.
+    """
+    from semantic_retrieval import precompute_embeddings, _inverse_norms, _text_key
+
+    if dtype not in _EMBED_DTYPES:
+        raise BundleError(f"Unsupported embedding dtype {dtype!r}; use one of {', '.join(_EMBED_DTYPES)}.")
+    ws = get_workspace(workspace)
+    chunks = load_chunk_store(ws.chunks_file)
+    if chunks is None or not len(chunks):
+        raise BundleError(f"Workspace '{ws.name}' has no indexed chunks to export.")
+
+    precompute_embeddings(ws)
+    embeddings = np.load(ws.embed_file, mmap_mode="r")
+    keys = [_text_key(chunks.text(i)) for i in range(len(chunks))]
+    if len(embeddings) != len(chunks) or json.loads(_read_file(ws.embed_ids_file) or b"null") != keys:
+        raise BundleError("Embeddings are not in sync with the chunks (was embedding skipped?); nothing exported.")
+
+    manifest = json.loads(_read_file(ws.sources_file) or b"{}")
+    chunking = _chunking_settings()
+    # What the stored chunks were actually cut with, which may predate the current settings
+    chunking["sources"] = sorted({entry.get("chunking", "") for entry in manifest.values()} - {""})
+
+    with atomic_write(path, "wb") as f:
+        f.write(MAGIC)
+        writer = _SectionWriter(f)
+        writer.add_rows("embeddings", embeddings, dtype)
+        # Norms of the rows as stored, so float16 rows still normalize to unit length
+        writer.add_array("inv_norms", np.concatenate([
+            _inverse_norms(np.asarray(embeddings[start:start + 65536], dtype=dtype))
+            for start in range(0, len(embeddings), 65536)
+        ]))
+        for name in _CHUNK_ARRAYS:
+            writer.add_array(name, getattr(chunks, name))
+        writer.add_bytes("tables", json.dumps(
+            {"sources": chunks.sources, "sections": chunks.sections, "types": chunks.types}).encode("utf-8"))
+        writer.add_bytes("embed_ids", json.dumps(keys).encode("utf-8"))
+        for name, aux_path in (("manifest", ws.sources_file), ("digests", ws.digests_file)):
+            data = _read_file(aux_path)
+            if data is not None:
+                writer.add_bytes(name, data)
+        if NEAR_DUPLICATE_DETECTION:
+            data, version = _duplicate_index(ws)
+            # Already an npz (compressed per array), and retagged for the importing store
+            writer.add_bytes("minhash", data, compress=False, corpus_version=list(version))
+
+        header = {
+            "format_version": FORMAT_VERSION,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "workspace": ws.name,
+            "model": EMBEDDING_MODEL,
+            "chunking": chunking,
+            "chunks": len(chunks),
+            "embedding_dtype": dtype,
+            "embedding_dim": int(embeddings.shape[1]),
+            "sections": writer.sections,
+        }
+        header_bytes = json.dumps(header, indent=1).encode("utf-8")
+        f.write(header_bytes)
+        f.write(_TRAILER.pack(len(header_bytes), hashlib.sha256(header_bytes).digest(), MAGIC))
+    return header
+
+
+def read_bundle_header(path):
+    """Reads and checks the bundle's header; raises BundleError if it is not a valid bundle."""
+    size = os.path.getsize(path)
+    if size < len(MAGIC) + _TRAILER.size:
+        raise BundleError(f"{path} is too small to be an index bundle.")
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise BundleError(f"{path} is not an index bundle.")
+        f.seek(size - _TRAILER.size)
+        header_len, header_sha, magic = _TRAILER.unpack(f.read(_TRAILER.size))
+        if magic != MAGIC or header_len > size - len(MAGIC) - _TRAILER.size:
+            raise BundleError(f"{path} is truncated.")
+        f.seek(size - _TRAILER.size - header_len)
+        header_bytes = f.read(header_len)
+    if hashlib.sha256(header_bytes).digest() != header_sha:
+        raise BundleError(f"{path} has a corrupt header.")
+    header = json.loads(header_bytes)
+    if header.get("format_version") != FORMAT_VERSION:
+        raise BundleError(f"Bundle format version {header.get('format_version')} is not supported "
+                          f"(this version reads {FORMAT_VERSION}).")
+    return header
+
+
+def verify_bundle(path, header=None, block_size=1 << 20):
+    """Checks every section against its SHA-256; raises BundleError on the first mismatch."""
+    header = header or read_bundle_header(path)
+    with open(path, "rb") as f:
+        for name, section in header["sections"].items():
+            f.seek(section["offset"])
+            digest = hashlib.sha256()
+            remaining = section["length"]
+            while remaining:
+                block = f.read(min(block_size, remaining))
+                if not block:
+                    raise BundleError(f"Section '{name}' is truncated.")
+                digest.update(block)
+                remaining -= len(block)
+            if digest.hexdigest() != section["sha256"]:
+                raise BundleError(f"Section '{name}' failed its checksum.")
+
+
+def check_compatibility(header):
+    """
+    Raises BundleError when the bundle can't be served with the local config
+    (different embedding model); returns warnings for differences that only
+    affect future ingests.
+    """
+    if header["model"] != EMBEDDING_MODEL:
+        raise BundleError(f"Bundle was embedded with {header['model']!r} but EMBEDDING_MODEL is "
+                          f"{EMBEDDING_MODEL!r}; its vectors can't be compared with local queries.")
+    if header["embedding_dtype"] not in _EMBED_DTYPES:
+        raise BundleError(f"Unsupported embedding dtype {header['embedding_dtype']!r}.")
+    warnings = []
+    local_tag = _chunking_settings()["tag"]
+    stale = [tag for tag in header["chunking"].get("sources", []) if tag != local_tag]
+    if stale:
+        warnings.append(f"Bundle chunks were cut with {', '.join(stale)} but local chunking is {local_tag}; "
+                        "re-ingesting those papers here will re-chunk and re-embed them.")
+    return warnings
+
+
+def _read_section(f, section):
+    f.seek(section["offset"])
+    data = f.read(section["length"])
+    return zlib.decompress(data) if section["compression"] == "zlib" else data
+
+
+def _read_array(f, section):
+    return np.frombuffer(_read_section(f, section), dtype=section["dtype"]).reshape(section["shape"])
+
+
+def _load_parts(path, header):
+    """Returns (ChunkStore, inverse norms, {aux name: bytes}) from the compressed sections."""
+    sections = header["sections"]
+    with open(path, "rb") as f:
+        arrays = {name: _read_array(f, sections[name]) for name in _CHUNK_ARRAYS}
+        tables = json.loads(_read_section(f, sections["tables"]))
+        inv_norms = _read_array(f, sections["inv_norms"])
+        aux = {name: _read_section(f, sections[name]) for name in ("embed_ids", "manifest", "digests", "minhash")
+               if name in sections}
+    return ChunkStore(arrays, tables), inv_norms, aux
+
+
+def _embeddings_map(path, header):
+    section = header["sections"]["embeddings"]
+    return np.memmap(path, dtype=section["dtype"], mode="r", offset=section["offset"],
+                     shape=tuple(section["shape"]))
+
+
+def _validated_header(path, verify):
+    header = read_bundle_header(path)
+    if verify:
+        verify_bundle(path, header)
+    for warning in check_compatibility(header):
+        print(f"Warning: {warning}")
+    return header
+
+
+def open_bundle(path, verify=True, budget_bytes=INDEX_CACHE_BUDGET_MB * 1024 * 1024):
+    """
+    Returns a CorpusIndex served straight from the bundle, with nothing
+    re-embedded or re-normalized. Embeddings larger than budget_bytes stay
+    memory-mapped in the bundle file; smaller ones are loaded into RAM.
+    Mount it with semantic_retrieval.mount_index() to serve it.
+    """
+    from semantic_retrieval import CorpusIndex
+
+    header = _validated_header(path, verify)
+    chunks, inv_norms, _ = _load_parts(path, header)
+    embeddings = _embeddings_map(path, header)
+    mmap = header["sections"]["embeddings"]["length"] > budget_bytes
+    st = os.stat(path)
+    return CorpusIndex(chunks, embeddings, ("bundle", st.st_mtime_ns, st.st_size), mmap=mmap, inv_norms=inv_norms)
+
+
+def import_bundle(path, workspace=None, verify=True):
+    """
+    Installs the bundle as the workspace's corpus, replacing what is there.
+    Embeddings are copied as-is with their row hashes, so nothing is
+    re-embedded. Returns the bundle header.
+    """
+    header = _validated_header(path, verify)
+    ws = get_workspace(workspace)
+    chunks, _, aux = _load_parts(path, header)
+
+    with workspace_lock(ws):
+        # Embeddings first: they only become trusted once the row hashes below match the chunks
+        embeddings = _embeddings_map(path, header)
+        with atomic_path(ws.embed_file) as tmp_path:
+            out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=embeddings.dtype, shape=embeddings.shape)
+            for start in range(0, len(embeddings), 65536):
+                out[start:start + 65536] = embeddings[start:start + 65536]
+            out.flush()
+            del out, embeddings
+        write_bytes_atomic(ws.embed_ids_file, aux["embed_ids"])
+
+        write_chunk_store(chunks, ws.chunks_file)
+
+        for name, aux_path in (("manifest", ws.sources_file), ("digests", ws.digests_file)):
+            if name in aux:
+                write_bytes_atomic(aux_path, aux[name])
+            elif os.path.exists(aux_path):
+                os.remove(aux_path)
+
+        # The MinHash index is tagged with the store version it mirrors, which is new here
+        minhash_path = duplicate_index_path(ws.chunks_file)
+        duplicates = None
+        if "minhash" in aux:
+            write_bytes_atomic(minhash_path, aux["minhash"])
+            duplicates = NearDuplicateIndex.load(minhash_path, header["sections"]["minhash"]["corpus_version"])
+        if duplicates is not None:
+            duplicates.save(minhash_path, store_version(ws.chunks_file))
+        elif os.path.exists(minhash_path):
+            os.remove(minhash_path)
+    return header
+
+
+def format_info(header):
+    sections = header["sections"]
+    total = sum(s["length"] for s in sections.values())
+    lines = [
+        f"Format version:  {header['format_version']}",
+        f"Created:         {header['created']} from workspace '{header['workspace']}'",
+        f"Model:           {header['model']}",
+        f"Chunks:          {header['chunks']}",
+        f"Embeddings:      {header['embedding_dim']}-dim {header['embedding_dtype']}",
+        f"Chunking:        {', '.join(header['chunking'].get('sources') or [header['chunking']['tag']])}",
+        f"Sections:        {total / (1024 * 1024):.1f} MB",
+    ]
+    for name, s in sections.items():
+        lines.append(f"  {name:<13} {s['length']:>12,} bytes{' (zlib)' if s['compression'] else ''}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export and import portable index bundles.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("export", help="Write a workspace's index to a bundle")
+    p.add_argument("bundle")
+    p.add_argument("--workspace", default=None)
+    p.add_argument("--dtype", choices=_EMBED_DTYPES, default=BUNDLE_EMBED_DTYPE)
+    p = sub.add_parser("import", help="Install a bundle as a workspace's index")
+    p.add_argument("bundle")
+    p.add_argument("--workspace", default=None)
+    p.add_argument("--no-verify", action="store_true", help="Skip checksum verification")
+    p = sub.add_parser("info", help="Describe a bundle and check it against config.py")
+    p.add_argument("bundle")
+    p.add_argument("--verify", action="store_true", help="Also verify every section checksum")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "export":
+            header = export_bundle(args.bundle, args.workspace, args.dtype)
+            print(f"Exported {header['chunks']} chunks to {args.bundle}")
+        elif args.command == "import":
+            header = import_bundle(args.bundle, args.workspace, verify=not args.no_verify)
+            print(f"Imported {header['chunks']} chunks into workspace '{get_workspace(args.workspace).name}'")
+        else:
+            header = read_bundle_header(args.bundle)
+            if args.verify:
+                verify_bundle(args.bundle, header)
+            print(format_info(header))
+            for warning in check_compatibility(header):
+                print(f"Warning: {warning}")
+    except (BundleError, OSError) as e:
+        print(f"Error: {e}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,29 @@
+import argparse
+import bisect
+import glob
+import hashlib
 import json
 import os
-from pypdf import PdfReader
-from config import CHUNKS_FILE, CHUNK_SIZE, CHUNK_OVERLAP, MEMORY_DIR
+import re
+from importlib import metadata
+from config import (
+    CHUNK_MODE, CHUNK_SIZE, CHUNK_OVERLAP, CHUNK_OVERLAP_TOKENS, EXTRACT_CACHE_DIR,
+    NEAR_DUPLICATE_DETECTION, DIGESTS_ENABLED,
+)
+from near_duplicates import (
+    NearDuplicateIndex, remove_near_duplicates, format_report, load_duplicate_index, duplicate_index_path,
+)
+from chunk_store import load_chunk_store, append_chunks, remove_sources, stored_sources, store_version
+from workspaces import get_workspace, workspace_lock, list_workspaces
+from atomic_io import write_json_atomic
+from paper_digest import update_digest, remove_digest
+from memory_profile import profile_stage
+
+# Bump when the way page text is extracted changes, to invalidate cached pages
+EXTRACTOR_VERSION = 1
+
+# Sentence ends followed by whitespace, or paragraph breaks
+_SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
 
 def chunk_text(text: str, chunk_size: int, overlap: int) -> list[str]:
     """Splits text into overlapping chunks."""
@@ -23,63 +45,362 @@ def chunk_text(text: str, chunk_size: int, overlap: int) -> list[str]:
         
     return chunks
 
-def extract_chunks_from_pdf(pdf_path: str) -> int:
+def _sentence_spans(text: str) -> list[tuple[int, int]]:
+    """(start, end) character spans of the sentences in text, whitespace excluded."""
+    spans, start = [], 0
+    for match in _SENTENCE_BREAK.finditer(text):
+        if match.start() > start:
+            spans.append((start, match.start()))
+        start = match.end()
+    if start < len(text) and text[start:].strip():
+        spans.append((start, len(text.rstrip())))
+    return spans
+
+def _token_limits():
+    """(tokenizer, max tokens per chunk) for the embedding model, leaving room for [CLS]/[SEP]."""
+    from semantic_retrieval import get_model
+    model = get_model()
+    return model.tokenizer, model.max_seq_length - 2
+
+def chunk_text_by_tokens(text: str, tokenizer, max_tokens: int, overlap_tokens: int) -> list[tuple[int, str]]:
+    """
+    Splits text into chunks of at most max_tokens word-pieces, so nothing is
+    truncated by the embedding model. Chunks end on sentence boundaries where
+    possible (a single over-long sentence is cut at token boundaries), and
+    consecutive chunks share up to overlap_tokens of trailing text: whole
+    sentences where they fit, else the trailing word-pieces of the sentence
+    that doesn't.
+    All sentences are tokenized in one batch call to the fast tokenizer.
+    Returns (start offset, chunk text) pairs.
+    """
+    spans = _sentence_spans(text)
+    if not spans:
+        return []
+
+    encoded = tokenizer(
+        [text[a:b] for a, b in spans],
+        add_special_tokens=False,
+        return_offsets_mapping=True,
+    )
+
+    # Units of (start, end, token count, token start offsets), none longer than max_tokens
+    units = []
+    for (a, _b), offsets in zip(spans, encoded["offset_mapping"]):
+        for i in range(0, len(offsets), max_tokens):
+            piece = offsets[i:i + max_tokens]
+            if piece:
+                units.append((a + piece[0][0], a + piece[-1][1], len(piece), [a + start for start, _ in piece]))
+
+    chunks, current, current_tokens = [], [], 0
+    for unit in units:
+        if current and current_tokens + unit[2] > max_tokens:
+            chunks.append(current)
+            # Carry trailing units over as overlap, as long as the new unit still fits
+            carry, carry_tokens = [], 0
+            for prev in reversed(current):
+                budget = min(overlap_tokens, max_tokens - unit[2]) - carry_tokens
+                if prev[2] > budget:
+                    if budget > 0:
+                        # Only the tail of this sentence fits: carry its last `budget` word-pieces
+                        starts = prev[3][-budget:]
+                        carry.insert(0, (starts[0], prev[1], budget, starts))
+                        carry_tokens += budget
+                    break
+                carry.insert(0, prev)
+                carry_tokens += prev[2]
+            current, current_tokens = carry, carry_tokens
+        current.append(unit)
+        current_tokens += unit[2]
+    if current:
+        chunks.append(current)
+
+    return [(c[0][0], text[c[0][0]:c[-1][1]]) for c in chunks]
+
+def _chunk_document(full_text: str) -> tuple[list[tuple[int, str]], str]:
+    """Chunks text per CHUNK_MODE. Returns ((start offset, text) pairs, description of the settings used)."""
+    if CHUNK_MODE == "tokens":
+        try:
+            tokenizer, max_tokens = _token_limits()
+            return (
+                chunk_text_by_tokens(full_text, tokenizer, max_tokens, CHUNK_OVERLAP_TOKENS),
+                f"tokens:{max_tokens}/{CHUNK_OVERLAP_TOKENS}",
+            )
+        except ImportError as e:
+            print(f"Token-aware chunking unavailable, using characters: {e}")
+
+    step = CHUNK_SIZE - CHUNK_OVERLAP
+    chunks = chunk_text(full_text, CHUNK_SIZE, CHUNK_OVERLAP)
+    return [(i * step, txt) for i, txt in enumerate(chunks)], f"chars:{CHUNK_SIZE}/{CHUNK_OVERLAP}"
+
+def _chunking_tag() -> str:
+    """Settings tag stored per source; a file is re-chunked when it no longer matches."""
+    if CHUNK_MODE == "tokens":
+        try:
+            return f"tokens:{_token_limits()[1]}/{CHUNK_OVERLAP_TOKENS}"
+        except ImportError:
+            pass
+    return f"chars:{CHUNK_SIZE}/{CHUNK_OVERLAP}"
+
+def truncation_report(workspace=None, batch_size=256) -> dict:
+    """
+    Measures how much of the stored chunk text the embedding model never sees
+    because it is cut off at max_seq_length.
+    """
+    chunks = load_chunk_store(get_workspace(workspace).chunks_file)
+    tokenizer, max_tokens = _token_limits()
+    report = {"chunks": 0, "truncated_chunks": 0, "tokens": 0, "truncated_tokens": 0,
+              "chars": 0, "truncated_chars": 0, "max_tokens": max_tokens}
+    if chunks is None:
+        return report
+
+    for start in range(0, len(chunks), batch_size):
+        texts = [chunks.text(i) for i in range(start, min(start + batch_size, len(chunks)))]
+        encoded = tokenizer(texts, add_special_tokens=False, return_offsets_mapping=True)
+        for text, offsets in zip(texts, encoded["offset_mapping"]):
+            report["chunks"] += 1
+            report["tokens"] += len(offsets)
+            report["chars"] += len(text)
+            if len(offsets) > max_tokens:
+                report["truncated_chunks"] += 1
+                report["truncated_tokens"] += len(offsets) - max_tokens
+                report["truncated_chars"] += len(text) - offsets[max_tokens][0]
+    return report
+
+def file_sha256(path: str) -> str:
+    """SHA-256 of a file's contents, read in blocks."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _extractor_tag() -> str:
+    # Read from package metadata so cache hits never pay for importing pypdf
+    return f"pypdf{metadata.version('pypdf')}-v{EXTRACTOR_VERSION}"
+
+def load_manifest(workspace=None) -> dict:
     """
-    Extract text from a PDF, chunk it, and store in chunks.json.
+    Returns {source: {"sha256", "path", "chunks", "duplicates": {chunk_id: canonical_id}}}
+    for every PDF ingested into the workspace.
+    """
+    sources_file = get_workspace(workspace).sources_file
+    if not os.path.exists(sources_file):
+        return {}
+    try:
+        with open(sources_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except json.JSONDecodeError:
+        print("Warning: sources.json was corrupted. Ignoring it.")
+        return {}
+
+def find_source_by_hash(digest: str, workspace=None):
+    """Returns the name under which a PDF with this SHA-256 was ingested, or None."""
+    for source, entry in load_manifest(workspace).items():
+        if entry.get("sha256") == digest:
+            return source
+    return None
+
+def extract_page_texts(pdf_path: str, digest: str = None) -> list[str]:
+    """
+    Returns the text of every page of the PDF. Results are cached on disk keyed
+    by the file's SHA-256 and the extractor version, so an identical file is
+    only ever parsed once, whatever its name.
+    """
+    digest = digest or file_sha256(pdf_path)
+    cache_path = os.path.join(EXTRACT_CACHE_DIR, f"{digest}-{_extractor_tag()}.json")
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except json.JSONDecodeError:
+            pass
+
+    from pypdf import PdfReader
+
+    reader = PdfReader(pdf_path)
+    pages = [page.extract_text() or "" for page in reader.pages]
+    write_json_atomic(cache_path, pages)
+    return pages
+
+def _prune_extract_cache(digest):
+    """Deletes the cached page texts for a PDF hash that no workspace's manifest refers to any more."""
+    if not digest:
+        return
+    for name in list_workspaces():
+        if any(entry.get("sha256") == digest for entry in load_manifest(name).values()):
+            return
+    for path in glob.glob(os.path.join(EXTRACT_CACHE_DIR, f"{digest}-*.json")):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def remove_source(source: str, workspace=None) -> list[str]:
+    """
+    Removes a source's chunks and manifest entry from the workspace.
+    Returns the other sources that had chunks dropped as near-duplicates of
+    this one; they should be re-ingested (with force=True) to restore that text.
+    """
+    ws = get_workspace(workspace)
+    with workspace_lock(ws):
+        manifest = load_manifest(ws)
+        if source in stored_sources(ws.chunks_file):
+            # Keep the saved near-duplicate index in step; a stale one is rebuilt on the next ingest
+            index_path = duplicate_index_path(ws.chunks_file)
+            duplicates = NearDuplicateIndex.load(index_path, store_version(ws.chunks_file))
+            remove_sources({source}, ws.chunks_file)
+            if duplicates is not None:
+                duplicates.remove_sources({source})
+                duplicates.save(index_path, store_version(ws.chunks_file))
+
+        remove_digest(source, ws)
+        removed = manifest.pop(source, None)
+        if removed is None:
+            return []
+        write_json_atomic(ws.sources_file, manifest, indent=2)
+        _prune_extract_cache(removed.get("sha256"))
+
+    prefix = f"{source}_chunk_"
+    return [
+        name for name, entry in manifest.items()
+        if any(canonical.startswith(prefix) for canonical in entry.get("duplicates", {}).values())
+    ]
+
+def extract_chunks_from_pdf(pdf_path: str, workspace=None, force: bool = False) -> int:
+    """
+    Extract text from a PDF, chunk it, and add it to the workspace's chunk store.
+    Files whose content is already indexed are skipped unless force is set.
     Returns number of new chunks extracted.
     """
+    ws = get_workspace(workspace)
     if not os.path.exists(pdf_path):
         print(f"Error: File not found at {pdf_path}")
         return 0
 
-    full_text = ""
+    # Other processes (watch_indexer, query_server) may be updating the same corpus
+    with workspace_lock(ws):
+        return _extract_chunks(pdf_path, ws, force)
+
+
+def _extract_chunks(pdf_path, ws, force):
+    base_name = os.path.basename(pdf_path)
+    digest = file_sha256(pdf_path)
+
+    # Skip parsing, chunking and embedding when this exact content is already indexed
+    manifest = load_manifest(ws)
+    entry = manifest.get(base_name, {})
+    if entry.get("sha256") == digest and entry.get("chunking") == _chunking_tag() and not force:
+        return 0
+    for source, other in manifest.items():
+        if other.get("sha256") == digest and source != base_name:
+            if base_name in manifest:
+                # base_name was overwritten with another paper's content, so its old rows must
+                # go, and papers deduplicated against them need their own text back
+                for name in remove_source(base_name, ws):
+                    if os.path.exists(manifest[name].get("path", "")):
+                        _extract_chunks(manifest[name]["path"], ws, True)
+            print(f"{base_name} is identical to already indexed {source}; skipping.")
+            return 0
+
     try:
-        reader = PdfReader(pdf_path)
-        for page in reader.pages:
-            text = page.extract_text()
-            if text:
-                full_text += text + "\n\n"
+        with profile_stage("extract pages"):
+            pages = extract_page_texts(pdf_path, digest)
     except Exception as e:
         print(f"Error reading PDF {pdf_path}: {e}")
         return 0
+
+    full_text = "".join(text + "\n\n" for text in pages if text)
+
+    # Character offset where each non-empty page starts, to tag chunks with a page number
+    page_starts, page_numbers, offset = [], [], 0
+    for number, text in enumerate(pages, 1):
+        if text:
+            page_starts.append(offset)
+            page_numbers.append(number)
+            offset += len(text) + 2
+    # full_text holds the same text; don't keep two copies of a large document alive
+    del pages
     
     # Crude sanitation
     # Replace multiple spaces/newlines could go here if needed, 
     # but simplest is often just to carry on.
     
-    text_chunks = chunk_text(full_text, CHUNK_SIZE, CHUNK_OVERLAP)
+    with profile_stage("chunk text"):
+        text_chunks, chunking = _chunk_document(full_text)
     
     new_chunks = []
-    base_name = os.path.basename(pdf_path)
     
-    for i, txt in enumerate(text_chunks):
+    for i, (start, txt) in enumerate(text_chunks):
         new_chunks.append({
             "chunk_id": f"{base_name}_chunk_{i}",
             "source": base_name,
             "section": f"Chunk {i+1}", # Approximate location
             "type": "text",
+            "page": page_numbers[bisect.bisect_right(page_starts, start) - 1],
             "text": txt
         })
 
-    # Load existing
-    existing_chunks = []
-    if os.path.exists(CHUNKS_FILE):
-        try:
-            with open(CHUNKS_FILE, "r", encoding="utf-8") as f:
-                existing_chunks = json.load(f)
-        except json.JSONDecodeError:
-            print("Warning: chunks.json was corrupted. Overwriting.")
-            existing_chunks = []
-
-    # Update or Append? 
-    # Current logic simply appends. In a real app we might want to deduplicate by source.
-    # For now, let's remove old chunks from the same source before adding new ones
-    # to avoid duplicates if re-uploaded.
-    filtered_chunks = [c for c in existing_chunks if c["source"] != base_name]
-    
-    final_chunks = filtered_chunks + new_chunks
+    # A re-ingested file replaces its old chunks instead of adding to them
+    replacing = base_name in stored_sources(ws.chunks_file)
+
+    # Drop chunks that repeat text already in the corpus (or earlier in this
+    # document), remembering which canonical chunk each one duplicates
+    links, duplicates = {}, None
+    if NEAR_DUPLICATE_DETECTION:
+        with profile_stage("near-duplicate check"):
+            duplicates = load_duplicate_index(ws.chunks_file)
+            if replacing:
+                duplicates.remove_sources({base_name})
+            new_chunks, links, report = remove_near_duplicates(new_chunks, duplicates)
+        if links:
+            print(format_report(base_name, report))
+
+    with profile_stage("save chunks"):
+        if replacing:
+            remove_sources({base_name}, ws.chunks_file, new_chunks)
+        else:
+            # Only the new rows are written
+            append_chunks(new_chunks, ws.chunks_file)
+        if duplicates is not None:
+            duplicates.save(duplicate_index_path(ws.chunks_file), store_version(ws.chunks_file))
+    if DIGESTS_ENABLED:
+        with profile_stage("build digest"):
+            update_digest(base_name, full_text, ws)
 
-    with open(CHUNKS_FILE, "w", encoding="utf-8") as f:
-        json.dump(final_chunks, f, indent=2)
+    manifest[base_name] = {
+        "sha256": digest,
+        "path": os.path.abspath(pdf_path),
+        "chunks": len(new_chunks),
+        "chunking": chunking,
+        "duplicates": links,
+    }
+    write_json_atomic(ws.sources_file, manifest, indent=2)
+    if entry.get("sha256") != digest:
+        _prune_extract_cache(entry.get("sha256"))
 
     return len(new_chunks)
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingestion utilities.")
+    parser.add_argument("--truncation-report", action="store_true",
+                        help="Report how much chunk text exceeds the embedding model's sequence limit")
+    parser.add_argument("--workspace", default=None)
+    args = parser.parse_args()
+
+    if args.truncation_report:
+        r = truncation_report(args.workspace)
+        if not r["chunks"]:
+            print("No chunks indexed.")
+            return
+        print(f"Model limit:        {r['max_tokens']} tokens per chunk")
+        print(f"Truncated chunks:   {r['truncated_chunks']} of {r['chunks']} "
+              f"({100 * r['truncated_chunks'] / r['chunks']:.1f}%)")
+        print(f"Tokens never seen:  {r['truncated_tokens']} of {r['tokens']} "
+              f"({100 * r['truncated_tokens'] / max(r['tokens'], 1):.1f}%)")
+        print(f"Text never seen:    {r['truncated_chars']} of {r['chars']} characters "
+              f"({100 * r['truncated_chars'] / max(r['chars'], 1):.1f}%)")
+    else:
+        parser.print_help()
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,36 @@
+import importlib
+import importlib.util
 import warnings
 # Temporarily suppress the deprecation warning for google.generativeai
 warnings.filterwarnings("ignore", message=".*google.generativeai.*deprecated.*")
 
-# Try to import the new API first
-try:
-    import google.genai as genai
+def _module_available(name):
+    try:
+        return importlib.util.find_spec(name) is not None
+    except ModuleNotFoundError:
+        return False
+
+# Only check which API is installed here; the SDK itself is imported on first
+# use, so importing this module (and starting the app) stays fast.
+if _module_available("google.genai"):
     GEMINI_AVAILABLE = True
     NEW_API = True
-except ImportError:
-    # Fall back to the old API
-    try:
-        import google.generativeai as genai
-        GEMINI_AVAILABLE = True
-        NEW_API = False
-    except ImportError:
-        GEMINI_AVAILABLE = False
-        NEW_API = False
-        print("Warning: google-generativeai module not available. LLM functionality will be limited.")
+elif _module_available("google.generativeai"):
+    GEMINI_AVAILABLE = True
+    NEW_API = False
+else:
+    GEMINI_AVAILABLE = False
+    NEW_API = False
+    print("Warning: google-generativeai module not available. LLM functionality will be limited.")
+
+_genai = None
+
+def get_genai():
+    """Import and return the Gemini SDK module (new API preferred)."""
+    global _genai
+    if _genai is None:
+        _genai = importlib.import_module("google.genai" if NEW_API else "google.generativeai")
+    return _genai
 
 from config import LLM_MODEL, LLM_TEMPERATURE, LLM_MAX_TOKENS
 
@@ -33,6 +47,8 @@ def generate_structured_report(question, chunks, api_key):
     # If Gemini is available, use it
     if GEMINI_AVAILABLE:
         try:
+            genai = get_genai()
+
             # Configure the API key
             genai.configure(api_key=api_key)
             
@@ -0,0 +1,134 @@
+"""
+Load test for query_server.py.
+
+Fires concurrent requests at /retrieve or /answer and reports latency
+percentiles and throughput. With --spawn, an in-process server using the stub
+LLM is started on a free port, so only the retrieval path is measured.
+
+    python load_test.py --spawn --requests 500 --concurrency 16
+    python load_test.py --url http://127.0.0.1:8765 --endpoint retrieve
+"""
+import argparse
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+DEFAULT_QUERIES = [
+    "What method is proposed to avoid deadlock?",
+    "How are Petri nets used in railway networks?",
+    "What are the main experimental results?",
+    "Which limitations do the authors discuss?",
+    "How is conflict between trains resolved?",
+]
+
+
+def _post(url, payload, timeout):
+    data = json.dumps(payload).encode("utf-8")
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        resp.read()
+        return resp.status
+
+
+def run_load_test(base_url, endpoint="answer", total_requests=200, concurrency=8,
+                  queries=None, top_k=5, timeout=60, workspace=None):
+    """Returns a dict with latency percentiles (ms), QPS and status counts."""
+    queries = queries or DEFAULT_QUERIES
+    url = f"{base_url.rstrip('/')}/{endpoint}"
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def one(i):
+        payload = {"query": queries[i % len(queries)], "top_k": top_k, "workspace": workspace}
+        start = time.perf_counter()
+        try:
+            status = _post(url, payload, timeout)
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except Exception:
+            status = "error"
+        elapsed = time.perf_counter() - start
+        with lock:
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == 200:
+                latencies.append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total_requests)))
+    wall = time.perf_counter() - start
+
+    report = {
+        "endpoint": endpoint,
+        "requests": total_requests,
+        "concurrency": concurrency,
+        "wall_seconds": wall,
+        "qps": statuses.get(200, 0) / wall if wall else 0.0,
+        "statuses": statuses,
+    }
+    if latencies:
+        ms = np.array(latencies) * 1000
+        report.update({
+            "p50_ms": float(np.percentile(ms, 50)),
+            "p95_ms": float(np.percentile(ms, 95)),
+            "p99_ms": float(np.percentile(ms, 99)),
+            "max_ms": float(ms.max()),
+        })
+    return report
+
+
+def print_report(report):
+    print(f"Endpoint:    /{report['endpoint']}")
+    print(f"Requests:    {report['requests']} (concurrency {report['concurrency']})")
+    print(f"Statuses:    {report['statuses']}")
+    print(f"Wall time:   {report['wall_seconds']:.2f} s")
+    print(f"Throughput:  {report['qps']:.1f} QPS")
+    if "p50_ms" in report:
+        print(f"Latency p50: {report['p50_ms']:.1f} ms")
+        print(f"Latency p95: {report['p95_ms']:.1f} ms")
+        print(f"Latency p99: {report['p99_ms']:.1f} ms")
+        print(f"Latency max: {report['max_ms']:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the RAG query service.")
+    parser.add_argument("--url", default=None, help="Base URL of a running server")
+    parser.add_argument("--spawn", action="store_true", help="Start an in-process server with the stub LLM")
+    parser.add_argument("--endpoint", choices=["answer", "retrieve"], default="answer")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--workspace", default=None)
+    parser.add_argument("--llm-delay", type=float, default=0.0, help="Seconds the stub LLM sleeps per answer")
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.url
+    if args.spawn or not base_url:
+        from functools import partial
+        from query_server import QueryService, create_server, stub_report
+
+        service = QueryService(answer_fn=partial(stub_report, delay=args.llm_delay))
+        service.warm_up()
+        server = create_server(port=0, service=service)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_port}"
+
+    try:
+        print_report(run_load_test(base_url, args.endpoint, args.requests, args.concurrency,
+                                   top_k=args.top_k, workspace=args.workspace))
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+            server.service.shutdown()
+
+
+if __name__ == "__main__":
+    main()
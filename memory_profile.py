@@ -0,0 +1,219 @@
+"""
+Opt-in memory instrumentation and the memory budget used by ingestion and embedding.
+
+When config.DEBUG is set, code wrapped in profile_stage("name") records the
+peak Python/NumPy allocation (tracemalloc) and the process RSS before, after
+and at its peak, so an OOM can be traced to the stage that caused it. With
+DEBUG off, profile_stage() costs nothing.
+
+MEMORY_BUDGET_MB is the resident size the pipeline aims to stay under. It is
+measured as anonymous memory (heap and NumPy buffers), not RSS: file pages of
+memory-mapped indexes are counted in RSS but the kernel can drop them at any
+time. AdaptiveBatchSize shrinks embedding batches as anonymous memory
+approaches the budget, and indexes that would not fit are memory-mapped
+instead of loaded.
+
+    python memory_profile.py papers/paper.pdf [--workspace NAME]   # profile one ingest
+"""
+import argparse
+import os
+import sys
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from config import DEBUG, MEMORY_BUDGET_MB, EMBED_BATCH_SIZE
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# stage -> {"calls", "traced_peak", "rss_before", "rss_after", "rss_peak"} in bytes
+MEMORY_PROFILE = {}
+
+_enabled = DEBUG
+_local = threading.local()
+_lock = threading.Lock()
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def enable_profiling(enabled=True):
+    """Turns profile_stage() recording on or off regardless of config.DEBUG."""
+    global _enabled
+    _enabled = enabled
+
+
+def current_rss():
+    """Resident set size of this process in bytes, or None where it can't be read."""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+def anonymous_rss():
+    """
+    Resident anonymous memory of this process in bytes (RSS minus file-backed
+    and shared pages, such as a memory-mapped index), or None where it can't
+    be read.
+    """
+    try:
+        with open("/proc/self/status", "rb") as f:
+            for line in f:
+                if line.startswith(b"RssAnon:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            fields = f.read().split()
+        return (int(fields[1]) - int(fields[2])) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    info = psutil.Process().memory_info()
+    return info.rss - getattr(info, "shared", 0)
+
+
+def _max_rss():
+    """Highest RSS this process has reached so far, in bytes, or None."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def memory_budget_bytes():
+    return MEMORY_BUDGET_MB * 1024 * 1024
+
+
+def memory_headroom():
+    """Bytes of anonymous memory left under the budget (never negative), or None if unknown."""
+    used = anonymous_rss()
+    if used is None:
+        return None
+    return max(memory_budget_bytes() - used, 0)
+
+
+@contextmanager
+def profile_stage(name):
+    """
+    Records peak memory for the enclosed block under `name` when profiling is
+    enabled. Stages may nest; tracemalloc's peak is process-wide, so stages
+    running concurrently on other threads are attributed to each other.
+    """
+    if not _enabled:
+        yield
+        return
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    stack = _local.__dict__.setdefault("stack", [])
+    # Carry the enclosing stage's peak so far across the reset below
+    if stack:
+        stack[-1]["carried"] = max(stack[-1]["carried"], tracemalloc.get_traced_memory()[1])
+    frame = {"carried": 0, "base": tracemalloc.get_traced_memory()[0]}
+    stack.append(frame)
+    tracemalloc.reset_peak()
+    rss_before, max_rss_before = current_rss(), _max_rss()
+    try:
+        yield
+    finally:
+        peak = max(frame["carried"], tracemalloc.get_traced_memory()[1])
+        stack.pop()
+        if stack:
+            stack[-1]["carried"] = max(stack[-1]["carried"], peak)
+        rss_after, max_rss_after = current_rss(), _max_rss()
+        rss_peak = max(v for v in (rss_before, rss_after, 0) if v is not None)
+        if max_rss_before is not None and max_rss_after > max_rss_before:
+            # The process high-water mark moved inside this stage
+            rss_peak = max(rss_peak, max_rss_after)
+
+        with _lock:
+            entry = MEMORY_PROFILE.setdefault(name, {
+                "calls": 0, "traced_peak": 0, "rss_before": rss_before, "rss_after": rss_after, "rss_peak": 0,
+            })
+            entry["calls"] += 1
+            entry["traced_peak"] = max(entry["traced_peak"], peak - frame["base"])
+            entry["rss_after"] = rss_after
+            entry["rss_peak"] = max(entry["rss_peak"], rss_peak)
+        if DEBUG:
+            print(f"[memory] {name}: traced peak {_mb(peak - frame['base'])}, RSS {_mb(rss_before)} -> {_mb(rss_after)}")
+
+
+class AdaptiveBatchSize:
+    """
+    Encode batch size that follows the memory budget: halved whenever
+    anonymous memory passes `high` of the budget, doubled (up to `maximum`)
+    while it stays under `low`. Stays fixed where it can't be read.
+    """
+
+    def __init__(self, start=EMBED_BATCH_SIZE, minimum=1, maximum=None, budget_bytes=None, low=0.6, high=0.85):
+        self.size = start
+        self.minimum = minimum
+        self.maximum = maximum or start * 8
+        self.budget_bytes = budget_bytes or memory_budget_bytes()
+        self.low = low
+        self.high = high
+
+    def update(self, rss=None):
+        """Adjusts the size after a batch; returns the size for the next one."""
+        rss = anonymous_rss() if rss is None else rss
+        if rss is None:
+            return self.size
+        if rss > self.high * self.budget_bytes:
+            self.size = max(self.minimum, self.size // 2)
+        elif rss < self.low * self.budget_bytes:
+            self.size = min(self.maximum, self.size * 2)
+        return self.size
+
+
+def _mb(value):
+    return "n/a" if value is None else f"{value / (1024 * 1024):.1f} MB"
+
+
+def format_report(profile=None):
+    profile = MEMORY_PROFILE if profile is None else profile
+    if not profile:
+        return "No stages recorded (memory profiling is enabled by config.DEBUG)."
+    width = max(len(stage) for stage in profile)
+    lines = [f"{'stage':<{width}}  {'calls':>5}  {'traced peak':>12}  {'RSS after':>12}  {'RSS peak':>12}"]
+    for stage, e in profile.items():
+        lines.append(
+            f"{stage:<{width}}  {e['calls']:>5}  {_mb(e['traced_peak']):>12}  "
+            f"{_mb(e['rss_after']):>12}  {_mb(e['rss_peak']):>12}"
+        )
+    lines.append(f"Memory budget: {MEMORY_BUDGET_MB} MB")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile memory use of ingesting and embedding a PDF.")
+    parser.add_argument("pdf")
+    parser.add_argument("--workspace", default=None)
+    args = parser.parse_args()
+
+    from ingest_pdfs import extract_chunks_from_pdf
+    from semantic_retrieval import precompute_embeddings, get_index
+
+    enable_profiling()
+    with profile_stage("ingest (total)"):
+        extract_chunks_from_pdf(args.pdf, args.workspace, force=True)
+    with profile_stage("embed (total)"):
+        precompute_embeddings(args.workspace)
+    get_index(args.workspace)
+    print(format_report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""
+Near-duplicate chunk detection with MinHash signatures and LSH banding.
+
+Each chunk is reduced to a set of word shingles, summarized by a MinHash
+signature whose agreement rate estimates Jaccard similarity. Signatures are
+split into bands and bucketed, so only chunks that collide in at least one
+band are compared, instead of every pair.
+
+The signatures and buckets of a workspace's corpus are saved next to its
+chunk store (chunks.minhash.npz) and updated as papers are added and
+removed, so an ingest only hashes the new paper's chunks.
+"""
+import json
+import os
+import re
+import zlib
+import numpy as np
+from config import (
+    NEAR_DUPLICATE_THRESHOLD, MINHASH_PERMUTATIONS, LSH_BANDS, SHINGLE_SIZE,
+)
+from chunk_store import load_chunk_store, store_version
+from atomic_io import atomic_write
+
+_PRIME = (1 << 31) - 1
+_WORD = re.compile(r"\w+")
+
+# Fixed seed so signatures are comparable across runs and processes
+_rng = np.random.default_rng(20240611)
+_A = _rng.integers(1, _PRIME, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+_B = _rng.integers(0, _PRIME, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+# Odd multipliers that fold each band of a signature into one bucket key
+_MIX = _rng.integers(0, 1 << 63, size=MINHASH_PERMUTATIONS, dtype=np.uint64) | np.uint64(1)
+
+
+def shingle_hashes(text: str, size: int = SHINGLE_SIZE) -> np.ndarray:
+    """32-bit hashes of the distinct word n-grams in text (lowercased)."""
+    words = _WORD.findall(text.lower())
+    if len(words) < size:
+        grams = [" ".join(words)] if words else []
+    else:
+        grams = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+    return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64)
+
+
+def minhash_signature(text: str) -> np.ndarray:
+    """MINHASH_PERMUTATIONS minimum hash values, one per universal hash function."""
+    hashes = shingle_hashes(text)
+    if len(hashes) == 0:
+        return np.full(MINHASH_PERMUTATIONS, _PRIME, dtype=np.uint32)
+    # (a * x + b) mod p for every (permutation, shingle) pair; fits in uint64
+    permuted = (_A[:, None] * hashes[None, :] + _B[:, None]) % _PRIME
+    return permuted.min(axis=1).astype(np.uint32)
+
+
+def band_keys(signatures, bands=LSH_BANDS):
+    """(bands, n) 64-bit bucket keys for a (n, MINHASH_PERMUTATIONS) signature matrix, one per band of each row."""
+    signatures = np.atleast_2d(signatures)
+    mixed = signatures.astype(np.uint64) * _MIX  # wraps modulo 2**64
+    # An explicit band width, since -1 can't be inferred when there are no rows
+    return mixed.reshape(len(signatures), bands, signatures.shape[1] // bands).sum(axis=2, dtype=np.uint64).T
+
+
+class NearDuplicateIndex:
+    """
+    LSH index over MinHash signatures. find() returns the key of an indexed
+    chunk whose estimated similarity is at least the threshold, or None.
+
+    Each band's bucket keys are kept sorted alongside their rows, so a lookup
+    is a binary search and the index saves and loads as a few arrays. Rows
+    added since the last merge sit in small per-band dicts until save().
+    """
+
+    def __init__(self, threshold=NEAR_DUPLICATE_THRESHOLD, bands=LSH_BANDS):
+        if MINHASH_PERMUTATIONS % bands:
+            raise ValueError("MINHASH_PERMUTATIONS must be divisible by LSH_BANDS.")
+        self.threshold = threshold
+        self.bands = bands
+        self.keys = []  # chunk_id per row
+        self.sources = []  # source per row
+        self.signatures = np.empty((0, MINHASH_PERMUTATIONS), dtype=np.uint32)
+        self._sorted_keys = np.empty((bands, 0), dtype=np.uint64)
+        self._sorted_rows = np.empty((bands, 0), dtype=np.int64)
+        self._pending = []
+        self._pending_buckets = [{} for _ in range(bands)]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key, signature, source=None):
+        row = len(self.keys)
+        self.keys.append(key)
+        self.sources.append(source)
+        self._pending.append(signature)
+        for b, band in enumerate(band_keys(signature, self.bands)[:, 0]):
+            self._pending_buckets[b].setdefault(int(band), []).append(row)
+
+    def _signature(self, row):
+        merged = len(self.signatures)
+        return self.signatures[row] if row < merged else self._pending[row - merged]
+
+    def find(self, signature):
+        """Returns (key, estimated similarity) of the closest indexed match above threshold, or (None, 0.0)."""
+        candidates = set()
+        for b, band in enumerate(band_keys(signature, self.bands)[:, 0]):
+            lo = np.searchsorted(self._sorted_keys[b], band, side="left")
+            hi = np.searchsorted(self._sorted_keys[b], band, side="right")
+            candidates.update(self._sorted_rows[b, lo:hi].tolist())
+            candidates.update(self._pending_buckets[b].get(int(band), ()))
+
+        best_key, best_score = None, 0.0
+        for row in candidates:
+            score = float(np.mean(self._signature(row) == signature))
+            if score > best_score:
+                best_key, best_score = self.keys[row], score
+        if best_score >= self.threshold:
+            return best_key, best_score
+        return None, 0.0
+
+    def _sort_buckets(self, keys, rows):
+        order = np.argsort(keys, axis=1, kind="stable")
+        self._sorted_keys = np.take_along_axis(keys, order, axis=1)
+        self._sorted_rows = np.take_along_axis(rows, order, axis=1)
+
+    def _merge(self):
+        """Moves pending rows into the sorted arrays."""
+        if not self._pending:
+            return
+        new = np.array(self._pending, dtype=np.uint32)
+        rows = np.arange(len(self.signatures), len(self.signatures) + len(new), dtype=np.int64)
+        self.signatures = np.concatenate([self.signatures, new])
+        self._sort_buckets(
+            np.concatenate([self._sorted_keys, band_keys(new, self.bands)], axis=1),
+            np.concatenate([self._sorted_rows, np.broadcast_to(rows, (self.bands, len(rows)))], axis=1),
+        )
+        self._pending = []
+        self._pending_buckets = [{} for _ in range(self.bands)]
+
+    def remove_sources(self, sources):
+        """Drops every row of the given sources. Returns the number of rows removed."""
+        self._merge()
+        keep = np.array([source not in sources for source in self.sources], dtype=bool)
+        removed = len(keep) - int(keep.sum())
+        if removed:
+            self.keys = [k for k, kept in zip(self.keys, keep) if kept]
+            self.sources = [s for s, kept in zip(self.sources, keep) if kept]
+            self.signatures = self.signatures[keep]
+            rows = np.arange(len(self.signatures), dtype=np.int64)
+            self._sort_buckets(band_keys(self.signatures, self.bands), np.broadcast_to(rows, (self.bands, len(rows))))
+        return removed
+
+    def save(self, path, corpus_version):
+        """Writes the index, tagged with the chunk store version it mirrors."""
+        self._merge()
+        sources = sorted(set(self.sources), key=str)
+        lookup = {source: i for i, source in enumerate(sources)}
+        meta = {
+            "chunk_ids": self.keys, "sources": sources, "corpus_version": list(corpus_version),
+            "params": [MINHASH_PERMUTATIONS, self.bands, SHINGLE_SIZE],
+        }
+        with atomic_write(path, "wb") as f:
+            np.savez(
+                f,
+                signatures=self.signatures,
+                sorted_keys=self._sorted_keys,
+                sorted_rows=self._sorted_rows,
+                source_idx=np.array([lookup[s] for s in self.sources], dtype=np.int32),
+                meta=np.array(json.dumps(meta)),
+            )
+
+    @classmethod
+    def load(cls, path, corpus_version):
+        """The index saved at path, or None if it is missing, corrupt or not for this corpus version."""
+        if corpus_version is None or not os.path.exists(path):
+            return None
+        index = cls()
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                meta = json.loads(str(data["meta"]))
+                if (meta["corpus_version"] != list(corpus_version)
+                        or meta["params"] != [MINHASH_PERMUTATIONS, index.bands, SHINGLE_SIZE]):
+                    return None
+                index.signatures = data["signatures"]
+                index._sorted_keys = data["sorted_keys"]
+                index._sorted_rows = data["sorted_rows"]
+                index.sources = [meta["sources"][i] for i in data["source_idx"].tolist()]
+        except (ValueError, OSError, KeyError):
+            return None
+        index.keys = meta["chunk_ids"]
+        return index
+
+
+def duplicate_index_path(chunks_file):
+    return os.path.splitext(chunks_file)[0] + ".minhash.npz"
+
+
+def load_duplicate_index(chunks_file):
+    """
+    The saved index for the corpus at chunks_file. When it is missing or
+    stale, it is rebuilt from the stored chunks (the only time existing
+    chunks are hashed).
+    """
+    index = NearDuplicateIndex.load(duplicate_index_path(chunks_file), store_version(chunks_file))
+    if index is None:
+        index = NearDuplicateIndex()
+        chunks = load_chunk_store(chunks_file)
+        for i in range(len(chunks) if chunks is not None else 0):
+            index.add(chunks.chunk_id(i), minhash_signature(chunks.text(i)), chunks.field("source", i))
+    return index
+
+
+def remove_near_duplicates(new_chunks: list[dict], index=None, embedding_dim: int = 384):
+    """
+    Filters new_chunks against the chunks already in `index` (see
+    load_duplicate_index) and against each other; kept chunks are added to it.
+
+    Returns (kept_chunks, links, report): links maps every dropped chunk_id to
+    the chunk_id of its canonical copy, and report summarizes the space saved.
+    """
+    index = NearDuplicateIndex() if index is None else index
+
+    kept, links = [], {}
+    chars_saved = 0
+    for chunk in new_chunks:
+        signature = minhash_signature(chunk["text"])
+        canonical, _ = index.find(signature)
+        if canonical is not None:
+            links[chunk["chunk_id"]] = canonical
+            chars_saved += len(chunk["text"])
+        else:
+            index.add(chunk["chunk_id"], signature, chunk["source"])
+            kept.append(chunk)
+
+    report = {
+        "chunks_in": len(new_chunks),
+        "duplicates": len(links),
+        "chars_saved": chars_saved,
+        "embedding_bytes_saved": len(links) * embedding_dim * 4,
+    }
+    return kept, links, report
+
+
+def format_report(source: str, report: dict) -> str:
+    return (
+        f"{source}: skipped {report['duplicates']} of {report['chunks_in']} chunks as near-duplicates "
+        f"({report['chars_saved'] / 1024:.1f} KB text, "
+        f"{report['embedding_bytes_saved'] / 1024:.1f} KB embeddings saved)"
+    )
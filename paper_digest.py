@@ -0,0 +1,353 @@
+"""
+Per-paper extractive digests and keyword index, built at ingest time.
+
+For each source we store the title, abstract, a few key sentences (scored by
+TF-IDF within the paper) and the counts of its most frequent terms. Overview
+questions ("what does paper X propose", "which papers mention Petri nets",
+"list the papers") are answered from this file in milliseconds, so the LLM is
+only called when an answer actually has to be synthesized.
+"""
+import json
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+from config import DIGEST_KEY_SENTENCES, DIGEST_TOP_TERMS, DIGEST_MAX_TOPIC_TERMS, DIGEST_INDEX_TERMS
+from workspaces import get_workspace, workspace_lock
+from atomic_io import write_json_atomic
+
+DIGEST_VERSION = 1
+
+_STOPWORDS = frozenset("""
+a about above after again against all also am an and any are as at be because been before being below
+between both but by can could did do does doing down during each few for from further had has have
+having he her here hers him his how i if in into is it its itself just may me might more most must my
+no nor not now of off on once only or other our ours out over own same she should so some such than
+that the their theirs them then there these they this those through to too under until up upon us
+very was we were what when where which while who whom why will with would you your yours et al fig
+figure table eq section paper papers document documents study studies article articles work propose
+proposed show shown use used using based thus however therefore given let one two three new
+ieee vol pp doi http https www transactions journal conference proceedings copyright license licensed
+""".split())
+
+_WORD = re.compile(r"[a-z]{3,}")
+_SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+")
+_ABSTRACT = re.compile(
+    r"\babstract\b\W*(?P<body>.+?)(?=\b(?:index terms|keywords|key words)\b|\n\s*(?:i\.|1\.?)\s+introduction\b|\bintroduction\n)",
+    re.IGNORECASE | re.DOTALL,
+)
+
+# Phrases that typically introduce a paper's contributions and findings
+_CUE_PHRASES = re.compile(
+    r"\b(?:we propose|we present|we develop|we introduce|this paper|this work|this article|"
+    r"results show|results indicate|we show|in conclusion|we conclude|contribution)",
+    re.IGNORECASE,
+)
+
+_MENTION_QUERY = re.compile(
+    r"^\s*(?:which|what)\s+(?:papers?|documents?|sources?|articles?|studies)\s+"
+    r"(?:mention|use|discuss|cover|talk about|refer to|address|apply|employ|contain|study|studies)s?\s+"
+    r"(?P<topic>.+?)\s*\??\s*$",
+    re.IGNORECASE,
+)
+_OVERVIEW_QUERY = re.compile(
+    r"^\s*(?:what\s+(?:does|do|is)\s+(?P<a>.+?)\s+(?:propose|present|introduce|contribute|about|do)"
+    r"|(?:summari[sz]e|give (?:me )?an overview of|overview of|digest of)\s+(?P<b>.+?))\s*\??\s*$",
+    re.IGNORECASE,
+)
+# Conjunctions, comparisons and clause openers: a topic containing one asks for synthesis
+_CLAUSE = re.compile(
+    r"[,;:]|\b(?:and|or|but|nor|versus|vs|than|compared?|comparing|differ\w*|between|how|why|when|where|"
+    r"whether|which|that|who|whose|while|whereas|because|if|so)\b",
+    re.IGNORECASE,
+)
+_LIST_QUERY = re.compile(
+    r"^\s*(?:list|which|what)\s+(?:all\s+)?(?:the\s+)?(?:papers|documents|sources)"
+    r"(?:\s+(?:are|do you have|do we have))?(?:\s+(?:indexed|available|uploaded|loaded|here))?\s*\??\s*$",
+    re.IGNORECASE,
+)
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _normalize(text):
+    # NFKC folds PDF ligatures (e.g. "ﬂ" -> "fl") so terms match what users type
+    return unicodedata.normalize("NFKC", text)
+
+
+def _stem(word):
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def terms(text):
+    """Lowercased, lightly stemmed content words of text."""
+    return [_stem(w) for w in _WORD.findall(_normalize(text).lower()) if w not in _STOPWORDS]
+
+
+def _extract_title(text):
+    """First plausible title lines: skips running headers and stops at the author line."""
+    lines = [l.strip() for l in _normalize(text).splitlines()[:15] if l.strip()]
+    title = []
+    for line in lines:
+        header_like = line.isupper() or re.search(r"\b(vol\.|no\.|doi|http|issn|©|copyright)", line, re.I)
+        if not title:
+            if not header_like and 15 <= len(line) <= 200 and not line.lower().startswith("abstract"):
+                title.append(line)
+            continue
+        if header_like or "," in line or line.lower().startswith("abstract") or len(title) >= 3:
+            break
+        title.append(line)
+    return " ".join(title)
+
+
+def _sentences(text):
+    # Lines repeated on many pages are running headers/footers, not content
+    lines = _normalize(text).splitlines()
+    repeated = {l for l, c in Counter(l.strip() for l in lines).items() if c >= 3 and len(l) > 10}
+    text = "\n".join(l for l in lines if l.strip() not in repeated)
+
+    # PDF text breaks lines mid-sentence; join them before splitting
+    flat = re.sub(r"-\n(?=[a-z])", "", text)
+    flat = re.sub(r"\s*\n\s*", " ", flat)
+    # dict.fromkeys drops repeats (running headers, chunk overlaps) but keeps order
+    return list(dict.fromkeys(s.strip() for s in _SENTENCE_BREAK.split(flat) if 40 <= len(s.strip()) <= 400))
+
+
+def build_digest(full_text):
+    """Extractive digest of one paper's text."""
+    match = _ABSTRACT.search(_normalize(full_text[:20000]))
+    abstract = re.sub(r"\s+", " ", match.group("body")).strip()[:2000] if match else ""
+
+    counts = Counter(terms(full_text))
+
+    # Score sentences by the mean TF-IDF of their terms, treating sentences as documents
+    sentences = _sentences(full_text)
+    sentence_terms = [set(terms(s)) for s in sentences]
+    df = Counter(t for st in sentence_terms for t in st)
+    n = len(sentences)
+    scored = []
+    for i, st in enumerate(sentence_terms):
+        sentence = sentences[i]
+        # Skip formula-heavy or fragmentary sentences
+        letters = sum(c.isalpha() or c.isspace() for c in sentence)
+        if len(st) < 4 or letters < 0.85 * len(sentence):
+            continue
+        score = sum((1 + math.log(max(counts[t], 1))) * math.log((n + 1) / (df[t] + 1)) for t in st) / len(st)
+        if _CUE_PHRASES.search(sentence):
+            score *= 1.5
+        scored.append((score, i))
+    key = sorted(i for _, i in sorted(scored, reverse=True)[:DIGEST_KEY_SENTENCES])
+
+    return {
+        "title": _extract_title(full_text),
+        "abstract": abstract,
+        "key_sentences": [sentences[i] for i in key],
+        # Only the most frequent terms, so the file (rewritten on every ingest) stays small
+        "term_counts": dict(counts.most_common(DIGEST_INDEX_TERMS)),
+        "term_total": sum(counts.values()),
+    }
+
+
+def _trim(digest):
+    """Cuts a digest written with every term count down to the DIGEST_INDEX_TERMS most frequent."""
+    if len(digest["term_counts"]) <= DIGEST_INDEX_TERMS:
+        return digest
+    counts = Counter(digest["term_counts"])
+    return dict(digest, term_counts=dict(counts.most_common(DIGEST_INDEX_TERMS)),
+                term_total=digest.get("term_total", sum(counts.values())))
+
+
+def _write(path, digests):
+    digests = {source: _trim(digest) for source, digest in digests.items()}
+    write_json_atomic(path, {"version": DIGEST_VERSION, "sources": digests})
+
+
+def load_digests(workspace=None):
+    """
+    Returns (digests by source, inverted index term -> set of sources), cached
+    until the digests file changes.
+    """
+    path = get_workspace(workspace).digests_file
+    if not os.path.exists(path):
+        return {}, {}
+    mtime = os.stat(path).st_mtime_ns
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1], cached[2]
+
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except json.JSONDecodeError:
+        return {}, {}
+    digests = data.get("sources", {}) if data.get("version") == DIGEST_VERSION else {}
+    index = {}
+    for source, digest in digests.items():
+        for term in digest["term_counts"]:
+            index.setdefault(term, set()).add(source)
+    with _cache_lock:
+        _cache[path] = (mtime, digests, index)
+    return digests, index
+
+
+def update_digest(source, full_text, workspace=None):
+    ws = get_workspace(workspace)
+    with workspace_lock(ws):
+        digests, _ = load_digests(ws)
+        digests = dict(digests)
+        digests[source] = build_digest(full_text)
+        _write(ws.digests_file, digests)
+
+
+def remove_digest(source, workspace=None):
+    ws = get_workspace(workspace)
+    with workspace_lock(ws):
+        digests, _ = load_digests(ws)
+        if source in digests:
+            digests = {s: d for s, d in digests.items() if s != source}
+            _write(ws.digests_file, digests)
+
+
+def top_terms(source, digests, index, n=DIGEST_TOP_TERMS):
+    """Highest TF-IDF terms of one source against the rest of the workspace."""
+    counts = digests[source]["term_counts"]
+    total = digests[source].get("term_total") or sum(counts.values()) or 1
+    num_sources = len(digests)
+    weights = {
+        term: (count / total) * (math.log((num_sources + 1) / (len(index.get(term, ())) + 1)) + 1)
+        for term, count in counts.items()
+    }
+    return [t for t, _ in sorted(weights.items(), key=lambda kv: kv[1], reverse=True)[:n]]
+
+
+def _find_source(reference, digests):
+    """
+    The source a free-text reference names, by title and file name terms.
+    The reference must match most of the title or of the file name, and
+    only one source may match best; otherwise returns None, since a topic
+    that merely occurs in a title ("petri nets") is a question for the LLM.
+    """
+    wanted = set(terms(reference))
+    if not wanted:
+        return next(iter(digests)) if len(digests) == 1 else None
+    scored = []
+    for source, digest in digests.items():
+        title_terms = set(terms(digest["title"]))
+        file_terms = set(terms(re.sub(r"[_\W]+", " ", os.path.splitext(source)[0])))
+        matched = len(wanted & (title_terms | file_terms)) / len(wanted)
+        covered = max(len(wanted & names) / len(names) if names else 0.0 for names in (title_terms, file_terms))
+        if matched >= 0.6 and covered >= 0.6:
+            scored.append(((matched, covered), source))
+    scored.sort(reverse=True)
+    if not scored or (len(scored) > 1 and scored[0][0] == scored[1][0]):
+        return None
+    return scored[0][1]
+
+
+def _is_bare_topic(topic):
+    """True for a short noun phrase; false for anything that asks for comparison or explanation."""
+    return 0 < len(terms(topic)) <= DIGEST_MAX_TOPIC_TERMS and not _CLAUSE.search(topic)
+
+
+def format_digest(source, digests, index):
+    digest = digests[source]
+    parts = [f"**{digest['title'] or source}** ({source})"]
+    if digest["abstract"]:
+        parts.append(f"**Abstract**\n{digest['abstract']}")
+    if digest["key_sentences"]:
+        parts.append("**Key Points**\n" + "\n".join(f"- {s}" for s in digest["key_sentences"]))
+    parts.append("**Key Terms**: " + ", ".join(top_terms(source, digests, index)))
+    return "\n\n".join(parts)
+
+
+def answer_from_digests(question, workspace=None):
+    """
+    Answers overview questions from the precomputed digests. Returns markdown,
+    or None when the question needs retrieval and the LLM. Only bare topics
+    and paper references are answered here; a question that goes on to ask
+    how, why or in comparison with what falls through to the LLM.
+    """
+    digests, index = load_digests(workspace)
+    if not digests:
+        return None
+    note = "\n\n*Answered from the precomputed paper digests.*"
+
+    if _LIST_QUERY.match(question):
+        lines = [f"- **{d['title'] or s}** ({s})" for s, d in sorted(digests.items())]
+        return f"**Indexed Papers ({len(digests)})**\n" + "\n".join(lines) + note
+
+    match = _MENTION_QUERY.match(question)
+    if match and _is_bare_topic(match.group("topic")):
+        wanted = terms(match.group("topic"))
+        sources = set.intersection(*(index.get(t, set()) for t in wanted))
+        topic = match.group("topic").strip()
+        if not sources:
+            # Only each paper's most frequent terms are indexed, so a miss isn't proof of absence
+            return None
+        ranked = sorted(sources, key=lambda s: -sum(digests[s]["term_counts"].get(t, 0) for t in wanted))
+        lines = [
+            f"- **{digests[s]['title'] or s}** ({s}): "
+            f"{sum(digests[s]['term_counts'].get(t, 0) for t in wanted)} mentions"
+            for s in ranked
+        ]
+        return f"**Papers mentioning {topic}**\n" + "\n".join(lines) + note
+
+    match = _OVERVIEW_QUERY.match(question)
+    if match and _is_bare_topic(match.group("a") or match.group("b")):
+        source = _find_source(match.group("a") or match.group("b"), digests)
+        if source is not None:
+            return format_digest(source, digests, index) + note
+
+    return None
+
+
+def _merge_overlapping(parts):
+    """Joins consecutive chunk texts, dropping the text each one repeats from the end of the previous."""
+    merged = parts[0] if parts else ""
+    for part in parts[1:]:
+        tail = merged[-2000:]
+        pos = tail.find(part[:64]) if len(part) >= 64 else -1
+        if pos >= 0 and part.startswith(tail[pos:]):
+            merged += part[len(tail) - pos:]
+        else:
+            merged += "\n" + part
+    return merged
+
+
+def rebuild_digests(workspace=None):
+    """Rebuilds every digest from the stored chunks, e.g. for corpora ingested before digests existed."""
+    from chunk_store import load_chunk_store
+
+    ws = get_workspace(workspace)
+    with workspace_lock(ws):
+        chunks = load_chunk_store(ws.chunks_file)
+        texts = {}
+        if chunks is not None:
+            for i in range(len(chunks)):
+                texts.setdefault(chunks.field("source", i), []).append(chunks.text(i))
+        digests = {source: build_digest(_merge_overlapping(parts)) for source, parts in texts.items()}
+        _write(ws.digests_file, digests)
+    return len(digests)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build or query the per-paper digests.")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild all digests from the stored chunks")
+    parser.add_argument("--ask", default=None, help="Answer an overview question from the digests")
+    parser.add_argument("--workspace", default=None)
+    args = parser.parse_args()
+
+    if args.rebuild:
+        print(f"Rebuilt digests for {rebuild_digests(args.workspace)} papers.")
+    if args.ask:
+        print(answer_from_digests(args.ask, args.workspace) or "Not an overview question; use retrieval.")
@@ -1,53 +1,139 @@
-from fpdf import FPDF
+from functools import lru_cache
 import os
- 
-class PDFReport(FPDF):
-    def header(self):
-        self.set_font('Arial', 'B', 16)
-        self.cell(0, 10, 'Research Report - Advanced RAG System', 0, 1, 'C')
-        self.ln(5)
-        self.set_font('Arial', '', 10)
-        self.set_text_color(128, 128, 128)  # Gray color
-        self.cell(0, 5, 'Intelligent Research Paper Analysis & Question Answering', 0, 1, 'C')
-        self.ln(5)
-        self.set_draw_color(0, 0, 0)
-        self.line(10, 35, 200, 35)  # Add a line separator
-        self.ln(5)
-
-    def footer(self):
-        self.set_y(-15)
-        self.set_font('Arial', 'I', 8)
-        self.set_text_color(128, 128, 128)  # Gray color
-        self.cell(0, 10, f'Page {self.page_no()}', 0, 0, 'C')
 
-def create_pdf_report(content: str, filename="research_report.pdf"):
+# Characters the core PDF fonts can't encode, mapped to close ASCII equivalents.
+# Built once and applied with a single str.translate per report.
+_SAFE_CHARS = str.maketrans({
+    "’": "'",
+    "‘": "'",
+    "“": '"',
+    "”": '"',
+    "–": "-",
+    "—": "-",
+    "…": "...",
+    "•": "-",
+})
+
+@lru_cache(maxsize=None)
+def _report_class():
     """
-    Generates a professional PDF from the text content using FPDF.
+    Defines the report class on first use, so fpdf (and its font tables) are
+    only imported when a report is actually rendered.
+    """
+    from fpdf import FPDF
+
+    class PDFReport(FPDF):
+        def header(self):
+            self.set_font('Arial', 'B', 16)
+            self.cell(0, 10, 'Research Report - Advanced RAG System', 0, 1, 'C')
+            self.ln(5)
+            self.set_font('Arial', '', 10)
+            self.set_text_color(128, 128, 128)  # Gray color
+            self.cell(0, 5, 'Intelligent Research Paper Analysis & Question Answering', 0, 1, 'C')
+            self.ln(5)
+            self.set_draw_color(0, 0, 0)
+            self.line(10, 35, 200, 35)  # Add a line separator
+            self.ln(5)
+            # Restore the body font, so page breaks inside a paragraph keep its style
+            self.set_font("Arial", size=12)
+            self.set_text_color(0, 0, 0)
+
+        def footer(self):
+            self.set_y(-15)
+            self.set_font('Arial', 'I', 8)
+            self.set_text_color(128, 128, 128)  # Gray color
+            self.cell(0, 10, f'Page {self.page_no()}', 0, 0, 'C')
+
+    return PDFReport
+
+def __getattr__(name):
+    # Keeps `from pdf_export import PDFReport` working with the deferred import
+    if name == "PDFReport":
+        return _report_class()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _wrap_lines(pdf, lines: list[str]):
     """
-    pdf = PDFReport()
+    Greedy word wrap for the current font, using memoized word widths.
+    fpdf's multi_cell re-measures the growing line for every character, which
+    dominates rendering time on long reports; measuring each distinct word
+    once keeps wrapping linear in the text length.
+    """
+    max_width = pdf.epw - 2 * pdf.c_margin
+    space_width = pdf.get_string_width(" ")
+    widths = {}
+
+    def width(word):
+        w = widths.get(word)
+        if w is None:
+            w = widths[word] = pdf.get_string_width(word)
+        return w
+
+    for line in lines:
+        if not line:
+            yield line
+            continue
+        current, current_width = [], 0.0
+        for word in line.split(" "):
+            w = width(word)
+            if w > max_width:
+                # Hard-break words wider than the page (URLs, long formulas)
+                if current:
+                    yield " ".join(current)
+                    current, current_width = [], 0.0
+                piece, piece_width = "", 0.0
+                for char in word:
+                    char_width = width(char)
+                    if piece_width + char_width > max_width:
+                        yield piece
+                        piece, piece_width = "", 0.0
+                    piece += char
+                    piece_width += char_width
+                word, w = piece, piece_width
+            extra = w + (space_width if current else 0.0)
+            if current and current_width + extra > max_width:
+                yield " ".join(current)
+                current, current_width = [word], w
+            else:
+                current.append(word)
+                current_width += extra
+        yield " ".join(current)
+
+@lru_cache(maxsize=32)
+def render_pdf_report(content: str) -> bytes:
+    """
+    Renders the report to PDF bytes entirely in memory.
+    Results are memoized by content, so Streamlit reruns for the same answer
+    don't render it again.
+    """
+    pdf = _report_class()()
     pdf.add_page()
-    
+
     # Set up the main content area
     pdf.set_font("Arial", size=12)
     pdf.set_text_color(0, 0, 0)  # Black color for content
-    
-    # Handle encoding issues
-    safe_content = content.replace("’", "'").replace("“", '"').replace("”", '"').replace("–", "-")
-    
-    # Split content into lines to handle long text properly
-    lines = safe_content.split('\n')
-    for line in lines:
-        # Make sure the line fits in the page width
-        if len(line) > 0:
-            # Use multi_cell to handle text wrapping with better formatting
-            pdf.multi_cell(0, 8, line[:180], ln=True, align='L')  # Limit line width to fit page
+
+    # Handle encoding issues: map common typography, then replace anything
+    # else outside latin-1 instead of failing the whole report
+    safe_content = content.translate(_SAFE_CHARS).encode("latin-1", "replace").decode("latin-1")
+
+    for line in _wrap_lines(pdf, safe_content.split('\n')):
+        if line:
+            pdf.cell(0, 8, line, align='L', new_x="LMARGIN", new_y="NEXT")
         else:
             pdf.ln(4)  # Add some space for empty lines
-    
+
     # Add a professional footer note
     pdf.ln(10)
     pdf.set_font("Arial", 'I', 9)
     pdf.set_text_color(128, 128, 128)  # Gray color
     pdf.cell(0, 5, 'Generated by Advanced RAG Academic Assistant', 0, 1, 'C')
-    
-    pdf.output(filename)
+
+    return bytes(pdf.output())
+
+def create_pdf_report(content: str, filename="research_report.pdf"):
+    """
+    Generates a professional PDF from the text content using FPDF.
+    """
+    with open(filename, "wb") as f:
+        f.write(render_pdf_report(content))
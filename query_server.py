@@ -0,0 +1,411 @@
+"""
+Standalone HTTP query service for the RAG pipeline.
+
+Exposes POST /ingest, /retrieve and /answer (plus GET /health) on top of one
+process-wide embedding model and cached corpus indexes, so every request
+shares the same warm state instead of re-doing setup per Streamlit session.
+Every endpoint accepts an optional "workspace" name (see workspaces.py).
+
+Run with:
+    python query_server.py [--host HOST] [--port PORT] [--stub-llm] [--shards N] [--bundle [WORKSPACE=]PATH]
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from config import (
+    TOP_K, SERVER_HOST, SERVER_PORT, SERVER_WORKERS,
+    SERVER_QUEUE_SIZE, SERVER_REQUEST_TIMEOUT,
+)
+from ingest_pdfs import extract_chunks_from_pdf
+from semantic_retrieval import retrieve_chunks, precompute_embeddings, get_index, mount_index, is_mounted
+from exact_search import exact_retrieve_chunks
+from paper_digest import answer_from_digests
+from index_bundle import open_bundle
+from sharded_retrieval import ShardedRetriever
+from workspaces import get_workspace
+from atomic_io import write_bytes_atomic
+
+MAX_BODY_BYTES = 100 * 1024 * 1024  # largest PDF accepted by /ingest
+
+
+class ServiceBusy(Exception):
+    """Raised when the bounded request queue is full."""
+
+
+class _Admission:
+    """
+    One admitted request's slot. It is given back once the request has
+    returned and any work it left running on the pool after a timeout has
+    finished, so timed-out requests can't pile up unbounded work.
+    """
+
+    def __init__(self, slots):
+        self._slots = slots
+        self._holders = 1
+        self._lock = threading.Lock()
+
+    def hold_until(self, future):
+        with self._lock:
+            self._holders += 1
+        future.add_done_callback(lambda _: self.release())
+
+    def release(self):
+        with self._lock:
+            self._holders -= 1
+            last = self._holders == 0
+        if last:
+            self._slots.release()
+
+
+def stub_report(question, chunks, api_key, delay=0.0):
+    """Cheap stand-in for generate_structured_report, used for load testing."""
+    if delay:
+        time.sleep(delay)
+    sources = sorted({c["source"] for c in chunks})
+    return f"**Stub answer** to: {question}\nBased on {len(chunks)} chunks from {', '.join(sources)}"
+
+
+class QueryService:
+    """
+    Shared state behind the HTTP handlers.
+
+    Encoding and scoring run on a fixed thread pool (the model and NumPy both
+    release the GIL for the heavy parts). At most `workers + queue_size`
+    requests are admitted at once; anything beyond that is rejected
+    immediately with ServiceBusy rather than piling up.
+    """
+
+    def __init__(self, answer_fn=None, workers=SERVER_WORKERS, queue_size=SERVER_QUEUE_SIZE,
+                 timeout=SERVER_REQUEST_TIMEOUT, shards=0):
+        if answer_fn is None:
+            from llm_answer import generate_structured_report
+            answer_fn = generate_structured_report
+        self.answer_fn = answer_fn
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rag-worker")
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._ingest_locks = {}
+        self._locks_guard = threading.Lock()
+        # With shards > 0, retrieval fans out to that many shard processes per workspace
+        self.shards = shards
+        self._sharded = {}
+        self._shard_start_locks = {}
+
+    @contextmanager
+    def _admitted(self):
+        if not self._slots.acquire(blocking=False):
+            raise ServiceBusy("Request queue is full, retry later.")
+        admission = _Admission(self._slots)
+        try:
+            yield admission
+        finally:
+            admission.release()
+
+    def _run(self, admission, fn, *args, bounded=True):
+        future = self.executor.submit(fn, *args)
+        try:
+            return future.result(timeout=self.timeout if bounded else None)
+        except FutureTimeout:
+            # A task that already started can't be stopped, so it keeps the slot until it ends
+            if not future.cancel():
+                admission.hold_until(future)
+            raise
+
+    def warm_up(self):
+        """Load the index and model (and start the default workspace's shards) before the first request arrives."""
+        from warmup import warm_up
+        warm_up()
+        if self.shards:
+            self._retriever(get_workspace())
+
+    def _retriever(self, ws):
+        """
+        The function that retrieves (chunks, failed shards) for ws: sharded
+        when configured, else in-process.
+        """
+        if not self.shards:
+            return lambda query, top_k: (retrieve_chunks(query, top_k, ws), [])
+        with self._locks_guard:
+            start_lock = self._shard_start_locks.setdefault(ws.name, threading.Lock())
+        # Starting waits for every shard to load, so only this workspace's requests wait on it
+        with start_lock:
+            if ws.name not in self._sharded:
+                self._sharded[ws.name] = ShardedRetriever.local(ws, self.shards)
+        return self._sharded[ws.name].retrieve_chunks
+
+    def _ingest_lock(self, workspace):
+        with self._locks_guard:
+            return self._ingest_locks.setdefault(workspace, threading.Lock())
+
+    def health(self, workspace=None):
+        index = get_index(workspace)
+        status = {
+            "status": "ok",
+            "chunks": len(index) if index is not None else 0,
+            "embedded": index is not None and index.embeddings is not None,
+        }
+        retriever = self._sharded.get(get_workspace(workspace).name)
+        if retriever is not None:
+            status["shards"] = retriever.health()
+            if not all(shard["healthy"] for shard in status["shards"]):
+                status["status"] = "degraded"
+        return status
+
+    def ingest(self, pdf_path, workspace=None):
+        """Ingests a PDF that is already in the workspace's papers folder."""
+        ws = _writable_workspace(workspace)
+        path = os.path.realpath(pdf_path)
+        papers_dir = os.path.realpath(ws.papers_dir)
+        if os.path.commonpath([path, papers_dir]) != papers_dir:
+            raise ValueError(f"Only PDFs inside {ws.papers_dir} can be ingested into workspace '{ws.name}'.")
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"File not found: {pdf_path}")
+        with self._admitted() as admission:
+            return self._ingest(admission, path, ws)
+
+    def ingest_upload(self, filename, data, workspace=None, overwrite=False):
+        """
+        Saves uploaded PDF bytes into the workspace's papers folder and
+        ingests them. A different paper already saved under the same name is
+        only replaced with overwrite=True.
+        """
+        ws = _writable_workspace(workspace)
+        filename = os.path.basename(filename or "")
+        if not filename.lower().endswith(".pdf") or filename.startswith("."):
+            raise ValueError("A ?filename=<name>.pdf query parameter is required.")
+        path = os.path.join(ws.papers_dir, filename)
+        with self._admitted() as admission:
+            if os.path.exists(path) and not overwrite:
+                with open(path, "rb") as f:
+                    if f.read() != data:
+                        raise ValueError(f"A different {filename} is already in workspace '{ws.name}'; "
+                                         f"pass ?overwrite=1 to replace it.")
+            os.makedirs(ws.papers_dir, exist_ok=True)
+            write_bytes_atomic(path, data)
+            return self._ingest(admission, path, ws)
+
+    def _ingest(self, admission, pdf_path, ws):
+        # Ingestion rewrites chunks.json and the embeddings file, so only
+        # one runs at a time per workspace; queries keep using the previous
+        # index until the new files are in place. It is not bounded by the
+        # request timeout: the lock must be held until the work finishes.
+        with self._ingest_lock(ws.name):
+            new_chunks = self._run(admission, extract_chunks_from_pdf, pdf_path, ws, bounded=False)
+            self._run(admission, precompute_embeddings, ws, bounded=False)
+            index = get_index(ws)
+        return {
+            "source": os.path.basename(pdf_path),
+            "new_chunks": new_chunks,
+            "total_chunks": len(index) if index is not None else 0,
+        }
+
+    def retrieve(self, query, top_k=TOP_K, workspace=None, exact=False):
+        ws = get_workspace(workspace)
+        if exact and is_mounted(ws):
+            raise ValueError(f"Workspace '{ws.name}' is served from an index bundle; exact search is not available.")
+        with self._admitted() as admission:
+            if exact:
+                # Exact search fans its blocks out to its own pool from the worker thread
+                retrieve = lambda query, top_k: (exact_retrieve_chunks(query, top_k, ws), [])
+            else:
+                retrieve = self._retriever(ws)
+            chunks, failed = self._run(admission, retrieve, query, top_k)
+            return {"chunks": [dict(c) for c in chunks], "partial": bool(failed), "failed_shards": failed}
+
+    def answer(self, query, top_k=TOP_K, api_key=None, workspace=None):
+        ws = get_workspace(workspace)
+        with self._admitted() as admission:
+            # Questions the precomputed digests can answer skip retrieval and the LLM.
+            # A mounted bundle's digests aren't on disk, so those always go to the LLM.
+            digest_answer = None if is_mounted(ws) else answer_from_digests(query, ws)
+            if digest_answer:
+                return {"answer": digest_answer, "chunks": [], "source": "digest", "partial": False, "failed_shards": []}
+            chunks, failed = self._run(admission, self._retriever(ws), query, top_k)
+            # The LLM call is network bound; keep it off the encode pool
+            answer = self.answer_fn(query, chunks, api_key)
+            return {"answer": answer, "chunks": [dict(c) for c in chunks], "source": "llm",
+                    "partial": bool(failed), "failed_shards": failed}
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        for retriever in self._sharded.values():
+            retriever.close()
+
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+    server_version = "RAGQueryService/1.0"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            raise ValueError("Request body too large.")
+        return self.rfile.read(length) if length else b""
+
+    def _read_json(self):
+        body = self._read_body()
+        if not body:
+            return {}
+        payload = json.loads(body)
+        if not isinstance(payload, dict):
+            raise ValueError("Request body must be a JSON object.")
+        return payload
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/health":
+            try:
+                workspace = parse_qs(url.query).get("workspace", [None])[0]
+                self._send_json(200, self.service.health(workspace))
+            except ValueError as e:
+                self._send_json(400, {"error": str(e)})
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        try:
+            if url.path == "/ingest":
+                payload = self._handle_ingest(url)
+            elif url.path == "/retrieve":
+                data = self._read_json()
+                query = _require_query(data)
+                payload = self.service.retrieve(
+                    query, int(data.get("top_k", TOP_K)), data.get("workspace"), bool(data.get("exact", False))
+                )
+            elif url.path == "/answer":
+                data = self._read_json()
+                query = _require_query(data)
+                payload = self.service.answer(query, int(data.get("top_k", TOP_K)), data.get("api_key"), data.get("workspace"))
+            else:
+                self._send_json(404, {"error": "Not found"})
+                return
+        except ServiceBusy as e:
+            self._send_json(503, {"error": str(e)}, headers={"Retry-After": "1"})
+            return
+        except FutureTimeout:
+            self._send_json(504, {"error": "Request timed out."})
+            return
+        except (ValueError, FileNotFoundError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        except Exception as e:
+            self._send_json(500, {"error": f"Internal error: {e}"})
+            return
+
+        self._send_json(200, payload)
+
+    def _handle_ingest(self, url):
+        """
+        Accepts either a JSON body {"path": "...", "workspace": "..."} pointing
+        at a PDF in the workspace's papers folder, or raw PDF bytes with
+        ?filename=paper.pdf[&workspace=name][&overwrite=1].
+        """
+        if self.headers.get("Content-Type", "").startswith("application/pdf"):
+            params = parse_qs(url.query)
+            return self.service.ingest_upload(
+                params.get("filename", [""])[0], self._read_body(), params.get("workspace", [None])[0],
+                params.get("overwrite", ["0"])[0] in ("1", "true"),
+            )
+        data = self._read_json()
+        path = data.get("path")
+        if not path:
+            raise ValueError("Missing 'path' in request body.")
+        return self.service.ingest(path, data.get("workspace"))
+
+
+def _writable_workspace(workspace):
+    ws = get_workspace(workspace)
+    if is_mounted(ws):
+        raise ValueError(f"Workspace '{ws.name}' is served from an index bundle and can't be ingested into.")
+    return ws
+
+
+def _require_query(data):
+    query = data.get("query", "")
+    if not isinstance(query, str) or not query.strip():
+        raise ValueError("Missing 'query' in request body.")
+    return query
+
+
+def create_server(host=SERVER_HOST, port=SERVER_PORT, service=None, verbose=False):
+    """Build (but do not start) a threaded HTTP server bound to host:port."""
+    server = ThreadingHTTPServer((host, port), QueryRequestHandler)
+    server.daemon_threads = True
+    server.service = service or QueryService()
+    server.verbose = verbose
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the RAG pipeline over HTTP.")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS)
+    parser.add_argument("--queue-size", type=int, default=SERVER_QUEUE_SIZE)
+    parser.add_argument("--stub-llm", action="store_true", help="Answer with a stub instead of Gemini")
+    parser.add_argument("--shards", type=int, default=0,
+                        help="Fan retrieval out to this many shard processes per workspace")
+    parser.add_argument("--no-warm-up", action="store_true")
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--bundle", action="append", default=[], metavar="[WORKSPACE=]PATH",
+                        help="Serve a workspace straight from an index bundle (repeatable)")
+    args = parser.parse_args()
+    if args.bundle and args.shards:
+        parser.error("--bundle can't be combined with --shards: shard workers load workspace files, not bundles.")
+
+    for spec in args.bundle:
+        name, _, path = spec.rpartition("=")
+        mount_index(name or None, open_bundle(path))
+        print(f"Serving workspace '{get_workspace(name or None).name}' from {path}")
+
+    service = QueryService(
+        answer_fn=stub_report if args.stub_llm else None,
+        workers=args.workers,
+        queue_size=args.queue_size,
+        shards=args.shards,
+    )
+    if not args.no_warm_up:
+        try:
+            service.warm_up()
+        except Exception as e:
+            print(f"Warm-up skipped: {e}")
+
+    server = create_server(args.host, args.port, service, verbose=args.verbose)
+    print(f"Serving on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+
+
+if __name__ == "__main__":
+    main()
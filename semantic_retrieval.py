@@ -1,7 +1,18 @@
+import hashlib
 import json
+import threading
+from collections import OrderedDict
 import numpy as np
 import os
-from config import TOP_K, EMBEDDING_MODEL, CHUNKS_FILE, EMBED_FILE
+from config import TOP_K, EMBEDDING_MODEL, INDEX_CACHE_BUDGET_MB
+from workspaces import get_workspace, workspace_lock
+from chunk_store import load_chunk_store, store_version
+from atomic_io import atomic_path, atomic_write, write_json_atomic
+from memory_profile import profile_stage, memory_headroom, AdaptiveBatchSize
+from exact_search import BlockwiseSearcher
+
+_model = None
+_model_lock = threading.Lock()
 
 def load_model():
     """Load the embedding model. This function will be used in the main app with caching."""
@@ -11,108 +22,342 @@ def load_model():
     except ImportError as e:
         raise ImportError(f"sentence_transformers package is not installed or has dependency issues. Error: {e}. Please install it using: pip install sentence-transformers")
 
-def precompute_embeddings():
+def get_model():
+    """Return the process-wide embedding model, loading it on first use. Shared by all workspaces."""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = load_model()
+    return _model
+
+class CorpusIndex:
+    """
+    An immutable snapshot of a workspace's chunks (a columnar ChunkStore) and
+    its embeddings.
+
+    Hot indexes hold a normalized float32 copy in RAM, so concurrent queries
+    only pay for the dot product. Memory-mapped indexes leave the vectors on
+    disk (in whatever dtype they were stored) and keep just the inverse row
+    norms; they are scored in float32 blocks by exact_search.BlockwiseSearcher.
     """
-    Computes embeddings for all chunks in chunks.json and saves to .npy
-    Optimized to avoid re-computing if not needed could be added, 
-    but for now we simply recompute all to ensure consistency.
+
+    def __init__(self, chunks, embeddings, version, mmap=False, inv_norms=None):
+        self.chunks = chunks
+        self.version = version
+        self.inv_norms = None
+        self._searcher = None
+        if len(embeddings) == len(chunks) and len(embeddings) > 0:
+            if mmap:
+                self.embeddings = embeddings
+                self.inv_norms = _inverse_norms(embeddings) if inv_norms is None else inv_norms
+                self._searcher = BlockwiseSearcher(embeddings, inv_norms=self.inv_norms)
+            else:
+                # One float32 copy, normalized in place block by block
+                self.embeddings = np.array(embeddings, dtype=np.float32)
+                self.embeddings *= (_inverse_norms(self.embeddings) if inv_norms is None else inv_norms)[:, None]
+        else:
+            self.embeddings = None
+
+    def __len__(self):
+        return len(self.chunks)
+
+    @property
+    def nbytes(self):
+        """Approximate resident size, used for the index cache budget."""
+        size = self.chunks.nbytes
+        if self.inv_norms is not None:
+            size += self.inv_norms.nbytes
+        elif self.embeddings is not None:
+            size += self.embeddings.nbytes
+        return size
+
+    def search(self, query_embedding, top_k=TOP_K):
+        """Returns (index, score) pairs for the top_k most similar chunks."""
+        if self.embeddings is None:
+            return []
+
+        k = min(top_k, len(self.chunks))
+        if k <= 0:
+            return []
+        if self._searcher is not None:
+            indices, scores = self._searcher.search(query_embedding, k)
+            return [(int(i), float(s)) for i, s in zip(indices[0], scores[0])]
+
+        norm = np.linalg.norm(query_embedding)
+        norm_query = query_embedding / norm if norm else query_embedding
+        scores = self.embeddings @ norm_query.astype(np.float32)
+        # argpartition keeps the selection linear; only the k winners get sorted
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top]
+
+def _inverse_norms(embeddings, block_rows=65536):
+    """Row norms computed block by block, so a memory-mapped matrix is never fully paged in at once."""
+    inv = np.empty(len(embeddings), dtype=np.float32)
+    for start in range(0, len(embeddings), block_rows):
+        norms = np.linalg.norm(np.asarray(embeddings[start:start + block_rows], dtype=np.float32), axis=1)
+        norms[norms == 0] = 1.0
+        inv[start:start + block_rows] = 1.0 / norms
+    return inv
+
+def _files_version(ws):
+    """Identifies the on-disk corpus state by the chunk store's and the embeddings file's mtimes and sizes."""
+    if os.path.exists(ws.embed_file):
+        st = os.stat(ws.embed_file)
+        return store_version(ws.chunks_file), (st.st_mtime_ns, st.st_size)
+    return store_version(ws.chunks_file), None
+
+class IndexCache:
     """
-    if not os.path.exists(CHUNKS_FILE):
+    LRU of workspace indexes under a memory budget. Indexes are loaded lazily
+    on first query; the least recently used ones are dropped when the budget is
+    exceeded and reloaded on their next query. A workspace whose embeddings
+    alone exceed the budget is memory-mapped instead of loaded.
+
+    Queries never embed. While an ingest has written new chunks but not yet
+    their embeddings, the last complete index keeps being served (or, for a
+    workspace without one, an index without embeddings).
+
+    Mounted indexes (e.g. opened straight from an index bundle) are pinned:
+    they are served as-is and never evicted or reloaded.
+    """
+
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self._indexes = OrderedDict()
+        self._mounted = {}
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        # name -> files version whose embeddings don't cover its chunks yet
+        self._pending = {}
+
+    def _load_lock(self, name):
+        with self._lock:
+            return self._load_locks.setdefault(name, threading.Lock())
+
+    def _cached(self, name, version):
+        with self._lock:
+            index = self._indexes.get(name)
+            if index is not None and (index.version == version or self._pending.get(name) == version):
+                self._indexes.move_to_end(name)
+                return index
+        return None
+
+    def get(self, workspace=None):
+        ws = get_workspace(workspace)
+        if ws.name in self._mounted:
+            return self._mounted[ws.name]
+        index = self._cached(ws.name, _files_version(ws))
+        if index is not None:
+            return index
+
+        # Loads of different workspaces proceed in parallel
+        with self._load_lock(ws.name):
+            version = _files_version(ws)
+            index = self._cached(ws.name, version)
+            if index is not None:
+                return index
+            if version[0] is None:
+                return None
+
+            index = self._load(ws, version)
+            with self._lock:
+                if index.embeddings is None and len(index) and ws.name in self._indexes:
+                    # Embeddings are behind the chunks: keep the last good index until they catch up
+                    self._pending[ws.name] = version
+                    self._indexes.move_to_end(ws.name)
+                    return self._indexes[ws.name]
+                self._pending.pop(ws.name, None)
+                self._indexes[ws.name] = index
+                self._indexes.move_to_end(ws.name)
+                self._evict()
+            return index
+
+    def _load(self, ws, version):
+        chunks = load_chunk_store(ws.chunks_file)
+        if version[1] is None or len(np.load(ws.embed_file, mmap_mode="r")) != len(chunks):
+            return CorpusIndex(chunks, np.array([]), version)
+        # Also memory-map when a RAM copy would push the process past MEMORY_BUDGET_MB
+        size = version[1][1]
+        headroom = memory_headroom()
+        mmap = size > self.budget_bytes or (headroom is not None and size > headroom)
+        with profile_stage("load index"):
+            # CorpusIndex copies what it keeps, so read through a map rather than a second buffer
+            embeddings = np.load(ws.embed_file, mmap_mode="r")
+            return CorpusIndex(chunks, embeddings, version, mmap=mmap)
+
+    def _evict(self):
+        total = sum(index.nbytes for index in self._indexes.values())
+        while total > self.budget_bytes and len(self._indexes) > 1:
+            _, index = self._indexes.popitem(last=False)
+            total -= index.nbytes
+
+    def is_mounted(self, workspace=None):
+        return get_workspace(workspace).name in self._mounted
+
+    def mount(self, workspace, index):
+        """Serves `index` for the workspace instead of its files for the rest of the process."""
+        with self._lock:
+            self._mounted[get_workspace(workspace).name] = index
+
+_indexes = IndexCache(INDEX_CACHE_BUDGET_MB * 1024 * 1024)
+
+def get_index(workspace=None):
+    """
+    Return the shared CorpusIndex for a workspace, reloading it only when its
+    chunks or embeddings changed on disk. Returns None when the
+    workspace has no corpus yet. Never embeds: new chunks become searchable
+    once precompute_embeddings() has run for them.
+    """
+    return _indexes.get(workspace)
+
+def mount_index(workspace, index):
+    """Pins a prebuilt CorpusIndex as the workspace's index (see index_bundle.open_bundle)."""
+    _indexes.mount(workspace, index)
+
+def is_mounted(workspace=None):
+    """True when the workspace is served from a mounted index instead of its own files."""
+    return _indexes.is_mounted(workspace)
+
+def encode_queries(queries):
+    """Encode one or more query strings with the shared model."""
+    return get_model().encode(list(queries), convert_to_numpy=True)
+
+def _text_key(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def _load_cached_embeddings(ws):
+    """
+    Returns (text hash per row, embeddings) for the current embeddings file, or
+    ([], None) if it can't be trusted. The embeddings are memory-mapped.
+    """
+    if not (os.path.exists(ws.embed_file) and os.path.exists(ws.embed_ids_file)):
+        return [], None
+    try:
+        with open(ws.embed_ids_file, "r", encoding="utf-8") as f:
+            keys = json.load(f)
+        embeddings = np.load(ws.embed_file, mmap_mode="r")
+    except (json.JSONDecodeError, ValueError, OSError):
+        return [], None
+    if len(keys) != len(embeddings):
+        return [], None
+    return keys, embeddings
+
+def _save_embeddings(ws, embeddings, keys):
+    # Written atomically, so a concurrent get_index() never reads a partial array
+    with atomic_write(ws.embed_file, "wb") as f:
+        np.save(f, embeddings)
+    _save_embedding_ids(ws, keys)
+
+def _save_embedding_ids(ws, keys):
+    if keys is None:
+        if os.path.exists(ws.embed_ids_file):
+            os.remove(ws.embed_ids_file)
         return
+    write_json_atomic(ws.embed_ids_file, keys)
+
+def precompute_embeddings(workspace=None):
+    """
+    Computes embeddings for all chunks in the workspace's chunk store and saves to .npy
+    Rows are keyed by a hash of the chunk text, so only chunks whose text was
+    not embedded before are encoded; when nothing changed the files are left
+    untouched.
+    """
+    ws = get_workspace(workspace)
+    with workspace_lock(ws):
+        _precompute_embeddings(ws)
 
-    with open(CHUNKS_FILE, "r", encoding="utf-8") as f:
-        chunks = json.load(f)
 
-    if not chunks:
+def _precompute_embeddings(ws):
+    with profile_stage("load chunks"):
+        chunks = load_chunk_store(ws.chunks_file)
+    if chunks is None:
+        return
+
+    if not len(chunks):
         # Save empty
-        np.save(EMBED_FILE, np.array([]))
+        _save_embeddings(ws, np.array([]), None)
         return
  
-    texts = [c["text"] for c in chunks]
+    keys = [_text_key(chunks.text(i)) for i in range(len(chunks))]
+    cached_keys, cached = _load_cached_embeddings(ws)
+    if cached_keys == keys:
+        return
+
+    cached_rows = {k: i for i, k in enumerate(cached_keys)}
+    missing = [i for i, k in enumerate(keys) if k not in cached_rows]
     
     try:
-        model = load_model()
-        embeddings = model.encode(texts, convert_to_numpy=True)
-        np.save(EMBED_FILE, embeddings)
-        print(f"Computed embeddings for {len(chunks)} chunks.")
+        with profile_stage("encode embeddings"), atomic_path(ws.embed_file) as tmp_path:
+            model = get_model() if missing else None
+            if missing:
+                dim = model.get_sentence_embedding_dimension() or model.encode(["dim"], convert_to_numpy=True).shape[1]
+            else:
+                dim = cached.shape[1]
+
+            # Rows are streamed into the output file rather than built up in RAM
+            embeddings = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(len(chunks), dim))
+            for i, k in enumerate(keys):
+                if k in cached_rows:
+                    embeddings[i] = cached[cached_rows[k]]
+            del cached
+            _encode_into(model, chunks, missing, embeddings)
+            embeddings.flush()
+            del embeddings
+        _save_embedding_ids(ws, keys)
+        print(f"Computed embeddings for {len(missing)} of {len(chunks)} chunks.")
     except ImportError as e:
         print(f"Embedding computation skipped: {e}")
         # Create a dummy embeddings file if needed
         if len(chunks) > 0:
             # Create zero embeddings array with appropriate shape
             dummy_embeddings = np.zeros((len(chunks), 384))  # 384 is a common embedding size
-            np.save(EMBED_FILE, dummy_embeddings)
+            _save_embeddings(ws, dummy_embeddings, None)
             print(f"Created dummy embeddings file with shape {dummy_embeddings.shape}")
     except Exception as e:
         print(f"Error during embedding computation: {e}")
         # Still create a dummy embeddings file
         if len(chunks) > 0:
             dummy_embeddings = np.zeros((len(chunks), 384))
-            np.save(EMBED_FILE, dummy_embeddings)
+            _save_embeddings(ws, dummy_embeddings, None)
             print(f"Created dummy embeddings file due to error: {dummy_embeddings.shape}")
 
-def retrieve_chunks(query, top_k=TOP_K):
-    if not os.path.exists(CHUNKS_FILE):
-        return []
-
-    with open(CHUNKS_FILE, "r", encoding="utf-8") as f:
-        chunks = json.load(f)
+def _encode_into(model, chunks, rows, out):
+    """Encodes chunks.text(i) for each i in rows into out[i], in batches sized to the memory budget."""
+    batch_size = AdaptiveBatchSize()
+    start = 0
+    while start < len(rows):
+        batch = rows[start:start + batch_size.size]
+        texts = [chunks.text(i) for i in batch]
+        out[batch] = model.encode(texts, batch_size=len(texts), convert_to_numpy=True)
+        start += len(batch)
+        batch_size.update()
 
-    if not chunks:
+def retrieve_chunks(query, top_k=TOP_K, workspace=None):
+    index = get_index(workspace)
+    if index is None or len(index) == 0:
         return []
 
-    # Ensure embeddings exist
-    if not os.path.exists(EMBED_FILE):
-        precompute_embeddings()
-        if not os.path.exists(EMBED_FILE):
-            return []
+    chunks = index.chunks
 
-    embeddings = np.load(EMBED_FILE)
-    
-    if len(embeddings) != len(chunks):
-        # Mismatch detected, recompute
-        precompute_embeddings()
-        embeddings = np.load(EMBED_FILE)
-
-    if len(embeddings) == 0:
+    if index.embeddings is None:
         # Return chunks with dummy scores if we can't compute embeddings
-        for chunk in chunks[:top_k]:
-            chunk["score"] = 0.5  # dummy score
-        return chunks[:top_k]
+        return _dummy_results(chunks, top_k)
 
     try:
-        model = load_model()
-        query_embedding = model.encode([query], convert_to_numpy=True)[0]
-
-        # Cosine similarity
-        # Normalize embeddings for dot product to be cosine similarity
-        norm_embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
-        norm_query = query_embedding / np.linalg.norm(query_embedding)
-
-        scores = norm_embeddings @ norm_query
-        
-        # Get top k
-        # Check if we have fewer chunks than top_k
-        k = min(top_k, len(chunks))
-        
-        top_indices = np.argsort(scores)[::-1][:k]
-
-        results = []
-        for i in top_indices:
-            chunk = chunks[i].copy()
-            chunk["score"] = float(scores[i])
-            results.append(chunk)
-
-        return results
+        query_embedding = encode_queries([query])[0]
+
+        # Only the returned chunks are materialized, as lightweight views
+        return [chunks.view(i, score) for i, score in index.search(query_embedding, top_k)]
     except ImportError as e:
         print(f"Embedding computation skipped: {e}")
         # Return chunks with dummy scores if we can't compute embeddings
-        for chunk in chunks[:top_k]:
-            chunk["score"] = 0.5  # dummy score
-        return chunks[:top_k]
+        return _dummy_results(chunks, top_k)
     except Exception as e:
         print(f"Error during retrieval: {e}")
         # Return chunks with dummy scores if we can't compute embeddings
-        for chunk in chunks[:top_k]:
-            chunk["score"] = 0.5  # dummy score
-        return chunks[:top_k]
+        return _dummy_results(chunks, top_k)
+
+def _dummy_results(chunks, top_k):
+    return [chunks.view(i, 0.5) for i in range(min(top_k, len(chunks)))]  # dummy score
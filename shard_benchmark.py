@@ -0,0 +1,110 @@
+"""
+Throughput benchmark for sharded retrieval.
+
+Builds a synthetic workspace in a temporary directory (random embeddings, short placeholder chunks
+spread over many sources), then for each shard count starts local shard
+processes, checks that the merged top-k matches a single-process exact
+search, and fires concurrent queries at the coordinator. Queries are random
+vectors, so the embedding model is not needed and only search is measured.
+
+    python shard_benchmark.py --chunks 200000 --shard-counts 1 2 4 8 --concurrency 16
+
+Scaling tracks the number of free cores: on a single core more shards only
+add coordination overhead.
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from config import TOP_K
+from workspaces import Workspace
+from chunk_store import write_chunk_store
+from semantic_retrieval import _text_key, _save_embeddings
+from sharded_retrieval import ShardedRetriever
+
+def build_corpus(ws, num_chunks, dim, num_sources, seed=0):
+    """Writes a synthetic corpus into the workspace and returns its embeddings."""
+    rng = np.random.default_rng(seed)
+    chunks = [{
+        "chunk_id": f"paper{i % num_sources}.pdf_chunk_{i}",
+        "source": f"paper{i % num_sources}.pdf",
+        "section": f"Chunk {i + 1}",
+        "type": "text",
+        "text": f"synthetic chunk {i}",
+    } for i in range(num_chunks)]
+    write_chunk_store(chunks, ws.chunks_file)
+    embeddings = rng.standard_normal((num_chunks, dim), dtype=np.float32)
+    _save_embeddings(ws, embeddings, [_text_key(c["text"]) for c in chunks])
+    return embeddings
+
+
+def exact_top_k(embeddings, query, k):
+    normalized = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    scores = normalized @ (query / np.linalg.norm(query))
+    return [int(i) for i in np.lexsort((np.arange(len(scores)), -scores))[:k]]
+
+
+def run(retriever, queries, top_k, concurrency):
+    latencies = []
+
+    def one(query):
+        start = time.perf_counter()
+        retriever.search(query, top_k)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, queries))
+    wall = time.perf_counter() - start
+    ms = np.array(latencies) * 1000
+    return {
+        "qps": len(queries) / wall,
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+    }
+
+
+def benchmark(ws, embeddings, args):
+    """Prints QPS and latency per shard count, and whether results match exact search."""
+    rng = np.random.default_rng(1)
+    queries = rng.standard_normal((args.queries, args.dim), dtype=np.float32)
+    expected = [exact_top_k(embeddings, q, args.top_k) for q in queries[:5]]
+    print(f"{os.cpu_count()} CPUs available\n")
+
+    print(f"{'shards':>6}  {'QPS':>8}  {'p50 ms':>8}  {'p95 ms':>8}  {'speed-up':>8}  exact")
+    baseline = None
+    for num_shards in args.shard_counts:
+        with ShardedRetriever.local(ws, num_shards, timeout=120) as retriever:
+            exact = all(
+                [c["chunk_id"] for c in retriever.search(q, args.top_k)[0]]
+                == [f"paper{i % args.sources}.pdf_chunk_{i}" for i in rows]
+                for q, rows in zip(queries, expected)
+            )
+            report = run(retriever, queries, args.top_k, args.concurrency)
+        baseline = baseline or report["qps"]
+        print(f"{num_shards:>6}  {report['qps']:>8.1f}  {report['p50_ms']:>8.1f}  {report['p95_ms']:>8.1f}  "
+              f"{report['qps'] / baseline:>7.2f}x  {'yes' if exact else 'NO'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sharded retrieval throughput by shard count.")
+    parser.add_argument("--chunks", type=int, default=200_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--sources", type=int, default=1000)
+    parser.add_argument("--shard-counts", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--top-k", type=int, default=TOP_K)
+    args = parser.parse_args()
+
+    # Kept out of the workspace registry, so it never shows up in the app
+    with tempfile.TemporaryDirectory() as tmp:
+        ws = Workspace("shard-bench", os.path.join(tmp, "papers"), tmp)
+        print(f"Building {args.chunks} x {args.dim} corpus in {tmp}...")
+        embeddings = build_corpus(ws, args.chunks, args.dim, args.sources)
+        benchmark(ws, embeddings, args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,432 @@
+"""
+Sharded scatter-gather retrieval across worker processes.
+
+The corpus is partitioned by a hash of each chunk's source, so a paper's
+chunks always live on the same shard. Every shard worker loads only its own
+slice of the vectors (normalized, in RAM) and the matching chunk metadata
+before it starts answering, and rebuilds it in the background when the
+workspace's files change, serving the old slice meanwhile. The coordinator encodes a
+query once, sends the vector to every shard in parallel and merges the
+per-shard top-k lists; since each shard returns its own exact top-k, the
+merged result is exactly the global top-k.
+
+Workers are local processes connected by pipes, or remote ones reached over
+TCP (multiprocessing.connection, which requires RAG_SHARD_AUTHKEY), behind
+the same client:
+
+    python sharded_retrieval.py serve --shard 0 --shards 4 --port 9100   # on each node
+    python sharded_retrieval.py query "deadlock avoidance" --shards 4     # local workers
+    python sharded_retrieval.py query "deadlock avoidance" --connect host1:9100 --connect host2:9101 ...
+"""
+import argparse
+import hashlib
+import heapq
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from multiprocessing.connection import Client, Listener
+import numpy as np
+from config import TOP_K, SHARD_COUNT, SHARD_TIMEOUT, SHARD_ALLOW_PARTIAL, SHARD_AUTHKEY
+from workspaces import get_workspace
+from chunk_store import ChunkStore, load_chunk_store
+from semantic_retrieval import _files_version, _inverse_norms
+
+
+class ShardUnavailable(Exception):
+    """Raised when a shard fails or times out and partial results are not allowed."""
+
+
+def shard_of(source, num_shards):
+    """Shard that owns every chunk of `source`; stable across processes and machines."""
+    return int(hashlib.sha1(source.encode("utf-8")).hexdigest()[:8], 16) % num_shards
+
+
+class _Slice:
+    """One immutable version of a shard's rows: global row numbers, normalized vectors and their chunks."""
+
+    def __init__(self, version, rows, vectors, chunks):
+        self.version = version
+        self.rows = rows
+        self.vectors = vectors
+        self.chunks = chunks
+
+
+_EMPTY_SLICE = _Slice(None, np.empty(0, dtype=np.int64), None, ChunkStore.from_dicts([]))
+
+
+class ShardIndex:
+    """
+    One shard's slice of a workspace index. Lives inside the worker process.
+
+    The first slice is loaded before the worker answers anything. When the
+    workspace's files change, the new slice is built on a background thread
+    while searches keep using the old one, so neither startup nor an ingest
+    makes a shard miss SHARD_TIMEOUT.
+    """
+
+    def __init__(self, workspace, shard, num_shards):
+        self.ws = get_workspace(workspace)
+        self.shard = shard
+        self.num_shards = num_shards
+        self._slice = _EMPTY_SLICE
+        self._attempted = None  # last files version a build was started for
+        self._building = None
+        self._lock = threading.Lock()
+        self._refresh(wait=True)
+
+    @property
+    def version(self):
+        return self._slice.version
+
+    def _build(self, version):
+        """Builds the slice for `version`; returns None if the embeddings don't cover the chunks yet."""
+        chunks = load_chunk_store(self.ws.chunks_file)
+        if chunks is None or not len(chunks) or version[1] is None:
+            return _Slice(version, _EMPTY_SLICE.rows, None, _EMPTY_SLICE.chunks)
+        embeddings = np.load(self.ws.embed_file, mmap_mode="r")
+        if len(embeddings) != len(chunks):
+            return None
+
+        owned = np.array([shard_of(s, self.num_shards) == self.shard for s in chunks.sources], dtype=bool)
+        rows = np.flatnonzero(owned[chunks.source_idx])
+        # Only this shard's rows are read from the mapped file
+        vectors = np.array(embeddings[rows], dtype=np.float32)
+        vectors *= _inverse_norms(vectors)[:, None]
+        return _Slice(version, rows, vectors, chunks.take(rows))
+
+    def _load(self, version):
+        try:
+            new = self._build(version)
+        except Exception as e:
+            print(f"Shard {self.shard}: reload failed, still serving the previous slice: {e}")
+            new = None
+        with self._lock:
+            if new is not None:
+                self._slice = new
+            self._building = None
+
+    def _refresh(self, wait=False):
+        version = _files_version(self.ws)
+        with self._lock:
+            if version in (self._slice.version, self._attempted) or self._building is not None:
+                return
+            self._attempted = version
+            if not wait:
+                self._building = threading.Thread(target=self._load, args=(version,),
+                                                  name=f"shard-{self.shard}-reload", daemon=True)
+                self._building.start()
+                return
+        self._load(version)
+
+    def search(self, query, top_k):
+        """query must be normalized. Returns [(score, global row, chunk dict)], best first."""
+        self._refresh()
+        current = self._slice
+        k = min(top_k, len(current.rows))
+        if k <= 0:
+            return []
+        scores = current.vectors @ query
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(float(scores[i]), int(current.rows[i]), dict(current.chunks[int(i)])) for i in top]
+
+    def info(self):
+        self._refresh()
+        current = self._slice
+        return {"shard": self.shard, "shards": self.num_shards, "chunks": len(current.rows),
+                "pid": os.getpid(), "version": current.version, "reloading": self._building is not None}
+
+
+def _serve_connection(conn, index):
+    """Answers (request id, op, args) messages on conn until told to stop or disconnected."""
+    while True:
+        try:
+            req_id, op, args = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            if op == "search":
+                result = index.search(*args)
+            elif op == "ping":
+                result = index.info()
+            elif op == "stop":
+                conn.send((req_id, True, None))
+                return
+            else:
+                raise ValueError(f"Unknown operation {op!r}")
+            conn.send((req_id, True, result))
+        except Exception as e:
+            conn.send((req_id, False, f"{type(e).__name__}: {e}"))
+
+
+def serve_shard(conn, workspace, shard, num_shards):
+    """Worker entry point: loads the shard's slice, then serves requests on conn."""
+    _serve_connection(conn, ShardIndex(workspace, shard, num_shards))
+
+
+class ShardClient:
+    """
+    Coordinator-side handle to one shard. Requests may overlap: each gets a
+    Future, and a reader thread resolves them as responses arrive.
+    """
+
+    def __init__(self, shard, conn, process=None):
+        self.shard = shard
+        self.conn = conn
+        self.process = process
+        self._ids = itertools.count()
+        self._pending = {}
+        self._lock = threading.Lock()  # guards _pending; never held while blocked on the pipe
+        self._send_lock = threading.Lock()
+        self._closed = False
+        self._reader = threading.Thread(target=self._read, name=f"shard-{shard}-reader", daemon=True)
+        self._reader.start()
+
+    def _read(self):
+        while True:
+            try:
+                req_id, ok, result = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                future = self._pending.pop(req_id, None)
+            if future is not None:
+                if ok:
+                    future.set_result(result)
+                else:
+                    future.set_exception(RuntimeError(f"Shard {self.shard}: {result}"))
+        # The worker is gone: fail whatever is still waiting
+        with self._lock:
+            self._closed = True
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(ConnectionError(f"Shard {self.shard} disconnected"))
+
+    @property
+    def alive(self):
+        return not self._closed and (self.process is None or self.process.is_alive())
+
+    def call(self, op, *args):
+        """Sends a request and returns a Future for its result."""
+        future = Future()
+        with self._lock:
+            if self._closed:
+                future.set_exception(ConnectionError(f"Shard {self.shard} disconnected"))
+                return future
+            future.req_id = next(self._ids)
+            self._pending[future.req_id] = future
+        try:
+            with self._send_lock:
+                self.conn.send((future.req_id, op, args))
+        except (OSError, ValueError) as e:
+            with self._lock:
+                # The reader may already have failed it on disconnect
+                if self._pending.pop(future.req_id, None) is not None:
+                    future.set_exception(ConnectionError(f"Shard {self.shard}: {e}"))
+        return future
+
+    def forget(self, future):
+        """Drops a request that timed out; a late response is discarded."""
+        with self._lock:
+            self._pending.pop(getattr(future, "req_id", None), None)
+
+    def close(self, timeout=2):
+        if self.alive:
+            try:
+                self.call("stop").result(timeout=timeout)
+            except Exception:
+                pass
+        self.conn.close()
+        if self.process is not None:
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+
+
+def _start_local_shard(ctx, workspace, shard, num_shards):
+    parent, child = ctx.Pipe()
+    process = ctx.Process(target=serve_shard, args=(child, workspace, shard, num_shards),
+                          name=f"rag-shard-{shard}", daemon=True)
+    process.start()
+    child.close()
+    return ShardClient(shard, parent, process)
+
+
+class ShardedRetriever:
+    """
+    Scatter-gather coordinator. Use ShardedRetriever.local() to run shards as
+    local processes, or ShardedRetriever.connect() for shards served elsewhere.
+    """
+
+    def __init__(self, clients, workspace=None, timeout=SHARD_TIMEOUT, allow_partial=SHARD_ALLOW_PARTIAL,
+                 restart=None):
+        self.clients = clients
+        self.workspace = get_workspace(workspace)
+        self.timeout = timeout
+        self.allow_partial = allow_partial
+        self._restart = restart  # shard -> new ShardClient, for shards we can bring back
+        self._lock = threading.Lock()
+
+    @classmethod
+    def local(cls, workspace=None, num_shards=SHARD_COUNT, **kwargs):
+        """Starts num_shards worker processes and returns once every one has loaded its slice."""
+        ws = get_workspace(workspace)
+        # spawn, not fork: the coordinator is usually multi-threaded (HTTP server, readers)
+        ctx = multiprocessing.get_context("spawn")
+        clients = [_start_local_shard(ctx, ws, s, num_shards) for s in range(num_shards)]
+        retriever = cls(clients, ws, restart=lambda s: _start_local_shard(ctx, ws, s, num_shards), **kwargs)
+        # Workers answer their first message only after loading, so this waits for the preload;
+        # a worker that dies while loading fails its ping instead of blocking
+        _, errors = retriever._gather("ping", timeout=None)
+        for shard, error in sorted(errors.items()):
+            print(f"Shard {shard} failed to start: {error}")
+        return retriever
+
+    @classmethod
+    def connect(cls, addresses, workspace=None, authkey=SHARD_AUTHKEY, **kwargs):
+        """addresses: (host, port) per shard, in shard order."""
+        if not authkey:
+            # Messages are pickles, so the handshake is what keeps out arbitrary code
+            raise ValueError("Set RAG_SHARD_AUTHKEY to connect to shards over TCP.")
+        clients = [ShardClient(s, Client(tuple(a), authkey=authkey)) for s, a in enumerate(addresses)]
+        restart = lambda s: ShardClient(s, Client(tuple(addresses[s]), authkey=authkey))
+        return cls(clients, workspace, restart=restart, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _gather(self, op, *args, timeout):
+        """Sends op to every shard at once; returns ({shard: result}, {shard: error}). timeout=None waits."""
+        futures = {client.shard: (client, client.call(op, *args)) for client in self.clients}
+        deadline = None if timeout is None else time.monotonic() + timeout
+        results, errors = {}, {}
+        for shard, (client, future) in futures.items():
+            try:
+                results[shard] = future.result(timeout=None if deadline is None else max(deadline - time.monotonic(), 0))
+            except FutureTimeout:
+                client.forget(future)
+                errors[shard] = f"timed out after {timeout}s"
+            except Exception as e:
+                errors[shard] = str(e)
+        return results, errors
+
+    def search(self, query_embedding, top_k=TOP_K):
+        """
+        Returns (chunks, failed shards). chunks are dicts with a "score", best
+        first, merged exactly from every shard that answered in time.
+        """
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        results, errors = self._gather("search", query, top_k, timeout=self.timeout)
+        if errors and not self.allow_partial:
+            raise ShardUnavailable("; ".join(f"shard {s}: {e}" for s, e in sorted(errors.items())))
+        for shard, error in sorted(errors.items()):
+            print(f"Shard {shard} failed: {error}")
+
+        # Ties are broken by global row, as a single-process search would
+        merged = heapq.nsmallest(top_k, itertools.chain.from_iterable(results.values()),
+                                 key=lambda hit: (-hit[0], hit[1]))
+        return [{**chunk, "score": score} for score, _, chunk in merged], sorted(errors)
+
+    def retrieve_chunks(self, query, top_k=TOP_K):
+        """Sharded counterpart of semantic_retrieval.retrieve_chunks. Returns (chunks, failed shards)."""
+        from semantic_retrieval import encode_queries
+        return self.search(encode_queries([query])[0], top_k)
+
+    def health(self, timeout=None, restart=True):
+        """
+        Pings every shard. Dead shards are restarted (or reconnected) when
+        possible. Returns one status dict per shard.
+        """
+        if restart and self._restart is not None:
+            with self._lock:
+                for i, client in enumerate(self.clients):
+                    if not client.alive:
+                        client.close(timeout=0)
+                        try:
+                            self.clients[i] = self._restart(client.shard)
+                            print(f"Restarted shard {client.shard}")
+                        except OSError as e:
+                            print(f"Shard {client.shard} could not be restarted: {e}")
+
+        start = time.perf_counter()
+        results, errors = self._gather("ping", timeout=self.timeout if timeout is None else timeout)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        status = []
+        for client in self.clients:
+            if client.shard in results:
+                status.append({"healthy": True, "latency_ms": elapsed_ms, **results[client.shard]})
+            else:
+                status.append({"healthy": False, "shard": client.shard, "error": errors.get(client.shard)})
+        return status
+
+    def close(self):
+        for client in self.clients:
+            client.close()
+
+
+def serve(workspace, shard, num_shards, host, port, authkey=SHARD_AUTHKEY):
+    """Serves one shard over TCP, one connection (coordinator) at a time."""
+    if not authkey:
+        # Even on loopback, any local user could otherwise send pickles the shard would load
+        raise SystemExit("Set RAG_SHARD_AUTHKEY before serving a shard.")
+    # Loaded once, before accepting, and kept across coordinator reconnects
+    index = ShardIndex(workspace, shard, num_shards)
+    with Listener((host, port), authkey=authkey) as listener:
+        print(f"Shard {shard}/{num_shards} of workspace '{get_workspace(workspace).name}' on {host}:{port}")
+        while True:
+            with listener.accept() as conn:
+                _serve_connection(conn, index)
+
+
+def _address(text):
+    host, _, port = text.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded scatter-gather retrieval.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("serve", help="Serve one shard over TCP")
+    p.add_argument("--shard", type=int, required=True)
+    p.add_argument("--shards", type=int, default=SHARD_COUNT)
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, required=True)
+    p.add_argument("--workspace", default=None)
+    p = sub.add_parser("query", help="Run one query through the shards")
+    p.add_argument("query")
+    p.add_argument("--shards", type=int, default=SHARD_COUNT, help="Number of local shard processes")
+    p.add_argument("--connect", action="append", default=[], metavar="HOST:PORT",
+                   help="Address of a running shard, in shard order (repeatable)")
+    p.add_argument("--top-k", type=int, default=TOP_K)
+    p.add_argument("--workspace", default=None)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.workspace, args.shard, args.shards, args.host, args.port)
+        return
+
+    if args.connect:
+        retriever = ShardedRetriever.connect([_address(a) for a in args.connect], args.workspace)
+    else:
+        retriever = ShardedRetriever.local(args.workspace, args.shards)
+    with retriever:
+        for status in retriever.health():
+            print(status)
+        chunks, failed = retriever.retrieve_chunks(args.query, args.top_k)
+        for rank, chunk in enumerate(chunks, 1):
+            print(f"{rank:>3}. {chunk['score']:.4f}  {chunk['source']}  {chunk['section']}")
+        if failed:
+            print(f"Partial results: shards {', '.join(map(str, failed))} did not answer.")
+
+
+if __name__ == "__main__":
+    main()
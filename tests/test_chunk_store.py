@@ -0,0 +1,107 @@
+import json
+import os
+import numpy as np
+import pytest
+from chunk_store import (append_chunks, load_chunk_store, remove_sources, store_dir,
+                         write_chunk_store, _column_path, _read_meta)
+
+
+def _chunks(start, count, num_sources=3):
+    return [{
+        "chunk_id": f"paper{i % num_sources}.pdf_chunk_{i}",
+        "source": f"paper{i % num_sources}.pdf",
+        "section": f"Section {i % 4}",
+        "type": "table" if i % 5 == 0 else "text",
+        "text": f"chunk {i} " + "é" * (i % 7),
+        "page": i,
+    } for i in range(start, start + count)]
+
+
+def _as_dicts(store):
+    return [dict(chunk) for chunk in store]
+
+
+def test_append_keeps_existing_rows(tmp_path):
+    chunks_file = str(tmp_path / "chunks.json")
+    write_chunk_store(_chunks(0, 10), chunks_file)
+    append_chunks(_chunks(10, 5), chunks_file)
+
+    assert _as_dicts(load_chunk_store(chunks_file)) == _chunks(0, 15)
+    # Appending does not start a new generation
+    assert _read_meta(chunks_file)["generation"] == 1
+
+
+def test_remove_sources_masks_rows_and_rebases_offsets(tmp_path):
+    chunks_file = str(tmp_path / "chunks.json")
+    write_chunk_store(_chunks(0, 12), chunks_file)
+    append_chunks(_chunks(12, 6), chunks_file)
+
+    removed = remove_sources({"paper1.pdf"}, chunks_file, _chunks(100, 2, num_sources=1))
+    store = load_chunk_store(chunks_file)
+
+    expected = [c for c in _chunks(0, 18) if c["source"] != "paper1.pdf"] + _chunks(100, 2, num_sources=1)
+    assert removed == 6
+    assert _as_dicts(store) == expected
+    assert store.text_offsets[0] == 0 and store.id_offsets[0] == 0
+    assert "paper1.pdf" not in store.sources
+    # Only the new generation's columns remain
+    assert all(name.endswith(".2") for name in os.listdir(store_dir(chunks_file)) if name != "meta.json")
+
+
+def test_remove_every_source_leaves_an_empty_store(tmp_path):
+    chunks_file = str(tmp_path / "chunks.json")
+    write_chunk_store(_chunks(0, 6), chunks_file)
+
+    assert remove_sources({"paper0.pdf", "paper1.pdf", "paper2.pdf"}, chunks_file) == 6
+    assert len(load_chunk_store(chunks_file)) == 0
+    append_chunks(_chunks(6, 2), chunks_file)
+    assert _as_dicts(load_chunk_store(chunks_file)) == _chunks(6, 2)
+
+
+def test_legacy_chunks_json_is_converted(tmp_path):
+    chunks_file = str(tmp_path / "chunks.json")
+    legacy = _chunks(0, 8)
+    del legacy[3]["page"]
+    with open(chunks_file, "w", encoding="utf-8") as f:
+        json.dump(legacy, f)
+
+    assert _as_dicts(load_chunk_store(chunks_file)) == legacy
+    assert _read_meta(chunks_file)["rows"] == 8
+
+
+def test_mapped_columns_match_loaded_ones(tmp_path):
+    chunks_file = str(tmp_path / "chunks.json")
+    write_chunk_store(_chunks(0, 9), chunks_file)
+    append_chunks(_chunks(9, 3), chunks_file)
+
+    store = load_chunk_store(chunks_file, mmap=True)
+    assert isinstance(store.text_buf, np.memmap)
+    assert _as_dicts(store) == _chunks(0, 12)
+    # Removing rows writes a new generation; the old maps keep reading the old one
+    remove_sources({"paper0.pdf"}, chunks_file)
+    assert _as_dicts(store) == _chunks(0, 12)
+
+
+@pytest.mark.parametrize("mmap", [False, True])
+def test_truncated_column_is_rejected(tmp_path, mmap):
+    chunks_file = str(tmp_path / "chunks.json")
+    write_chunk_store(_chunks(0, 5), chunks_file)
+    path = _column_path(chunks_file, "page", 1)
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 4)
+
+    with pytest.raises(ValueError):
+        load_chunk_store(chunks_file, mmap=mmap)
+
+
+def test_bytes_past_the_committed_length_are_ignored(tmp_path):
+    chunks_file = str(tmp_path / "chunks.json")
+    write_chunk_store(_chunks(0, 5), chunks_file)
+    # What an append interrupted before meta.json was replaced leaves behind
+    for name in ("text_buf", "page"):
+        with open(_column_path(chunks_file, name, 1), "ab") as f:
+            np.arange(3, dtype=np.int32).tofile(f)
+
+    assert _as_dicts(load_chunk_store(chunks_file)) == _chunks(0, 5)
+    append_chunks(_chunks(5, 2), chunks_file)
+    assert _as_dicts(load_chunk_store(chunks_file)) == _chunks(0, 7)
@@ -0,0 +1,21 @@
+import re
+from ingest_pdfs import chunk_text_by_tokens
+
+
+class WhitespaceTokenizer:
+    """One word-piece per whitespace-separated word, with character offsets."""
+
+    def __call__(self, texts, add_special_tokens=False, return_offsets_mapping=True):
+        return {"offset_mapping": [[(m.start(), m.end()) for m in re.finditer(r"\S+", t)] for t in texts]}
+
+
+def test_overlap_carries_tail_of_sentence_that_does_not_fit():
+    # Six 10-word sentences; whole sentences never fit in a 4-token overlap
+    text = " ".join(" ".join(f"s{i}w{j}" for j in range(9)) + f" s{i}w9." for i in range(6))
+    chunks = chunk_text_by_tokens(text, WhitespaceTokenizer(), max_tokens=25, overlap_tokens=4)
+
+    assert len(chunks) > 1
+    for (_, previous), (start, chunk) in zip(chunks, chunks[1:]):
+        assert previous.split()[-4:] == chunk.split()[:4]
+        assert len(chunk.split()) <= 25
+        assert text[start:start + len(chunk)] == chunk
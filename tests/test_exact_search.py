@@ -0,0 +1,34 @@
+import numpy as np
+from exact_search import BlockwiseSearcher
+
+
+def _expected(embeddings, queries, k):
+    normalized = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    scores = (queries / np.linalg.norm(queries, axis=1, keepdims=True)) @ normalized.T
+    return np.argsort(-scores, axis=1, kind="stable")[:, :k], np.sort(scores, axis=1)[:, ::-1][:, :k]
+
+
+def test_blockwise_matches_full_argsort(tmp_path):
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((100, 16), dtype=np.float32)
+    queries = rng.standard_normal((3, 16), dtype=np.float32)
+    path = tmp_path / "embeddings.npy"
+    np.save(path, embeddings)
+
+    # 7 rows per block leaves a ragged last block and many merges
+    indices, scores = BlockwiseSearcher(str(path), block_rows=7, workers=2).search(queries, 10)
+    expected_indices, expected_scores = _expected(embeddings, queries, 10)
+    assert indices.tolist() == expected_indices.tolist()
+    np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+
+
+def test_top_k_larger_than_corpus(tmp_path):
+    rng = np.random.default_rng(1)
+    embeddings = rng.standard_normal((5, 4), dtype=np.float32)
+    path = tmp_path / "embeddings.npy"
+    np.save(path, embeddings)
+
+    indices, _ = BlockwiseSearcher(str(path), block_rows=7, workers=1).search(embeddings[2], 10)
+    assert indices.shape == (1, 5)
+    assert indices[0, 0] == 2
+    assert sorted(indices[0].tolist()) == list(range(5))
@@ -0,0 +1,65 @@
+import time
+import numpy as np
+from workspaces import Workspace
+from chunk_store import append_chunks, write_chunk_store
+from semantic_retrieval import _save_embeddings, _text_key
+from sharded_retrieval import ShardedRetriever, ShardIndex
+
+
+def _chunks(start, count, num_sources=5):
+    return [{
+        "chunk_id": f"paper{i % num_sources}.pdf_chunk_{i}",
+        "source": f"paper{i % num_sources}.pdf",
+        "section": f"Chunk {i + 1}",
+        "type": "text",
+        "text": f"synthetic chunk {i}",
+    } for i in range(start, start + count)]
+
+
+def _workspace(tmp_path, embeddings):
+    ws = Workspace("test", str(tmp_path / "papers"), str(tmp_path))
+    chunks = _chunks(0, len(embeddings))
+    write_chunk_store(chunks, ws.chunks_file)
+    _save_embeddings(ws, embeddings, [_text_key(c["text"]) for c in chunks])
+    return ws
+
+
+def _expected_ids(embeddings, query, k):
+    scores = (embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)) @ (query / np.linalg.norm(query))
+    rows = np.lexsort((np.arange(len(scores)), -scores))[:k]
+    return [f"paper{i % 5}.pdf_chunk_{i}" for i in rows]
+
+
+def test_two_shards_match_single_process(tmp_path):
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((120, 16), dtype=np.float32)
+    ws = _workspace(tmp_path, embeddings)
+
+    with ShardedRetriever.local(ws, 2, timeout=30) as retriever:
+        # Both shards loaded their slices before local() returned
+        assert sum(status["chunks"] for status in retriever.health()) == 120
+        for query in rng.standard_normal((5, 16), dtype=np.float32):
+            chunks, failed = retriever.search(query, 10)
+            assert failed == []
+            assert [c["chunk_id"] for c in chunks] == _expected_ids(embeddings, query, 10)
+
+
+def test_reload_keeps_serving_previous_slice(tmp_path):
+    rng = np.random.default_rng(1)
+    embeddings = rng.standard_normal((40, 8), dtype=np.float32)
+    ws = _workspace(tmp_path, embeddings)
+    index = ShardIndex(ws, 0, 1)
+    query = embeddings[3]
+    assert index.search(query / np.linalg.norm(query), 1)[0][1] == 3
+
+    more = rng.standard_normal((10, 8), dtype=np.float32)
+    append_chunks(_chunks(40, 10), ws.chunks_file)
+    combined = np.concatenate([embeddings, more])
+    _save_embeddings(ws, combined, [_text_key(c["text"]) for c in _chunks(0, 50)])
+
+    # The old slice answers while the new one is built
+    assert len(index.search(query / np.linalg.norm(query), 50)) in (40, 50)
+    deadline = time.monotonic() + 10
+    while index.info()["chunks"] != 50 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert index.info()["chunks"] == 50
@@ -0,0 +1,107 @@
+"""
+Background warm-up of heavy dependencies and a startup-time report.
+
+The app modules import torch, sentence-transformers, pypdf, fpdf and the
+Gemini SDK lazily. warm_up() pays those costs ahead of time: it imports them,
+loads the embedding model, runs a test encode, embeds chunks an interrupted
+ingest left behind and loads the default index.
+start_background_warmup() does this on a daemon thread as soon as the server
+starts, so neither the first page render nor the first query waits for it.
+
+    python warmup.py --report    # where import and initialization time goes
+"""
+import argparse
+import importlib
+import threading
+import time
+
+# stage -> seconds (or an error string), filled in by warm_up()
+STARTUP_TIMINGS = {}
+
+_thread = None
+_thread_lock = threading.Lock()
+
+
+def _timed(stage, fn):
+    start = time.perf_counter()
+    try:
+        result = fn()
+    except Exception as e:
+        STARTUP_TIMINGS[stage] = f"unavailable ({type(e).__name__}: {e})"
+        return None
+    STARTUP_TIMINGS[stage] = time.perf_counter() - start
+    return result
+
+
+def _import_gemini():
+    from llm_answer import GEMINI_AVAILABLE, get_genai
+    if GEMINI_AVAILABLE:
+        return get_genai()
+    raise ImportError("google-genai / google-generativeai not installed")
+
+
+def warm_up(workspace=None):
+    """
+    Imports heavy dependencies, loads and test-encodes the model, embeds any
+    chunks an interrupted ingest left without embeddings, and loads the index.
+    """
+    from semantic_retrieval import get_model, get_index, precompute_embeddings, is_mounted
+
+    _timed("import pypdf", lambda: importlib.import_module("pypdf"))
+    _timed("import fpdf", lambda: importlib.import_module("fpdf"))
+    _timed("import Gemini SDK", _import_gemini)
+    _timed("import torch", lambda: importlib.import_module("torch"))
+    _timed("import sentence_transformers", lambda: importlib.import_module("sentence_transformers"))
+    model = _timed("load embedding model", get_model)
+    if model is not None:
+        _timed("first encode", lambda: model.encode(["warm-up"], convert_to_numpy=True))
+    if not is_mounted(workspace):
+        _timed("embed pending chunks", lambda: precompute_embeddings(workspace))
+    _timed("load index", lambda: get_index(workspace))
+    return STARTUP_TIMINGS
+
+
+def start_background_warmup(workspace=None):
+    """Starts warm_up() on a daemon thread once per process and returns the thread."""
+    global _thread
+    with _thread_lock:
+        if _thread is None:
+            _thread = threading.Thread(target=warm_up, args=(workspace,), name="warm-up", daemon=True)
+            _thread.start()
+    return _thread
+
+
+def format_report(timings=None):
+    # Snapshot: the warm-up thread may still be adding stages
+    timings = dict(STARTUP_TIMINGS if timings is None else timings)
+    width = max((len(stage) for stage in timings), default=0)
+    lines = []
+    total = 0.0
+    for stage, value in timings.items():
+        if isinstance(value, float):
+            total += value
+            lines.append(f"{stage:<{width}}  {value * 1000:9.1f} ms")
+        else:
+            lines.append(f"{stage:<{width}}  {value}")
+    lines.append(f"{'total':<{width}}  {total * 1000:9.1f} ms")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Warm up the pipeline and report startup costs.")
+    parser.add_argument("--report", action="store_true", help="Print a per-stage timing breakdown")
+    parser.add_argument("--workspace", default=None)
+    args = parser.parse_args()
+
+    # What the first page render pays: importing the app's own modules
+    _timed("import app modules", lambda: [
+        importlib.import_module(m)
+        for m in ("config", "ingest_pdfs", "semantic_retrieval", "llm_answer", "pdf_export")
+    ])
+    warm_up(args.workspace)
+    if args.report:
+        print(format_report())
+
+
+if __name__ == "__main__":
+    main()
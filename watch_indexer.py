@@ -0,0 +1,135 @@
+"""
+Long-running indexer that keeps a workspace's index in sync with its papers folder.
+
+The folder is polled (portable across local disks and network shares, where
+inotify events are unreliable). A PDF is only ingested once its size and
+modification time have stayed the same for WATCH_SETTLE_SECONDS, so files
+still being copied are never read half-written. New and changed files are
+ingested, deleted files are removed from the index, and embeddings are then
+updated incrementally. The chunk store and the embeddings are updated
+atomically, and running apps pick up the new index version on their next
+query (semantic_retrieval reloads when the files change).
+
+    python watch_indexer.py [--workspace NAME] [--interval 5] [--once]
+"""
+import argparse
+import os
+import time
+from config import WATCH_POLL_INTERVAL, WATCH_SETTLE_SECONDS
+from workspaces import get_workspace
+from ingest_pdfs import extract_chunks_from_pdf, remove_source, load_manifest
+from semantic_retrieval import precompute_embeddings
+
+
+def _scan(directory):
+    """Returns {filename: (size, mtime_ns)} for the PDFs directly inside directory."""
+    files = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            name = entry.name
+            if not name.lower().endswith(".pdf") or name.startswith((".", "~$")):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            if entry.is_file():
+                files[name] = (st.st_size, st.st_mtime_ns)
+    return files
+
+
+class FolderIndexer:
+    """Tracks the papers folder between polls and applies the differences to the index."""
+
+    def __init__(self, workspace=None, settle_seconds=WATCH_SETTLE_SECONDS):
+        self.ws = get_workspace(workspace)
+        self.settle_seconds = settle_seconds
+        self._seen = {}      # name -> (signature, first time this signature was seen)
+        self._indexed = {}   # name -> signature last handed to ingestion
+
+    def poll(self, now=None):
+        """
+        Scans once and ingests or removes whatever settled since the last poll.
+        Returns (ingested, removed) lists of file names.
+        """
+        now = time.monotonic() if now is None else now
+        current = _scan(self.ws.papers_dir)
+
+        ready = []
+        for name, signature in current.items():
+            previous = self._seen.get(name)
+            if previous is None or previous[0] != signature:
+                self._seen[name] = (signature, now)
+                continue
+            if signature[0] > 0 and now - previous[1] >= self.settle_seconds and self._indexed.get(name) != signature:
+                ready.append(name)
+
+        # Only sources ingested from this folder are removed when their file disappears
+        papers_dir = os.path.abspath(self.ws.papers_dir)
+        removed = [
+            name for name, entry in load_manifest(self.ws).items()
+            if name not in current and os.path.dirname(entry.get("path", "")) == papers_dir
+        ]
+        for name in list(self._seen):
+            if name not in current:
+                del self._seen[name]
+                self._indexed.pop(name, None)
+
+        reingest = set()
+        for name in removed:
+            reingest.update(remove_source(name, self.ws))
+            # Files skipped as identical to the removed one can now be indexed
+            self._indexed.clear()
+
+        ingested = []
+        for name in sorted(set(ready) | (reingest & set(current))):
+            path = os.path.join(self.ws.papers_dir, name)
+            try:
+                count = extract_chunks_from_pdf(path, self.ws, force=name in reingest)
+            except Exception as e:
+                print(f"Failed to ingest {name}: {e}")
+                continue
+            self._indexed[name] = current[name]
+            if count:
+                ingested.append(name)
+
+        if ingested or removed:
+            precompute_embeddings(self.ws)
+        return ingested, removed
+
+    def run(self, interval=WATCH_POLL_INTERVAL):
+        print(f"Watching {self.ws.papers_dir} (workspace '{self.ws.name}') every {interval}s")
+        while True:
+            try:
+                ingested, removed = self.poll()
+                if ingested or removed:
+                    print(f"Index updated: {len(ingested)} ingested, {len(removed)} removed")
+            except OSError as e:
+                # Network shares drop out; keep going and retry on the next poll
+                print(f"Scan failed: {e}")
+            time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep the index in sync with the papers folder.")
+    parser.add_argument("--workspace", default=None)
+    parser.add_argument("--interval", type=float, default=WATCH_POLL_INTERVAL)
+    parser.add_argument("--settle", type=float, default=WATCH_SETTLE_SECONDS)
+    parser.add_argument("--once", action="store_true", help="Index whatever is in the folder and exit")
+    args = parser.parse_args()
+
+    indexer = FolderIndexer(args.workspace, settle_seconds=0 if args.once else args.settle)
+    if args.once:
+        # Two polls: the first records signatures, the second ingests
+        indexer.poll()
+        ingested, removed = indexer.poll()
+        print(f"Index updated: {len(ingested)} ingested, {len(removed)} removed")
+        return
+    try:
+        indexer.run(args.interval)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Named workspaces, each with its own papers folder, chunk store and embeddings.
+
+The default workspace uses the paths in config.py, so existing corpora keep
+working unchanged. Every other workspace lives under WORKSPACES_DIR/<name>/.
+"""
+import os
+import re
+import threading
+from contextlib import contextmanager
+from config import (
+    PAPERS_DIR, CHUNKS_FILE, EMBED_FILE, EMBED_IDS_FILE, SOURCES_FILE, DIGESTS_FILE,
+    DEFAULT_WORKSPACE, WORKSPACES_DIR,
+)
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads within one process are serialized
+    fcntl = None
+
+_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class Workspace:
+    """File locations for one workspace's corpus."""
+
+    __slots__ = ("name", "papers_dir", "chunks_file", "embed_file", "embed_ids_file", "sources_file", "digests_file",
+                 "lock_file")
+
+    def __init__(self, name, papers_dir, memory_dir):
+        self.name = name
+        self.papers_dir = papers_dir
+        self.chunks_file = os.path.join(memory_dir, os.path.basename(CHUNKS_FILE))
+        self.embed_file = os.path.join(memory_dir, os.path.basename(EMBED_FILE))
+        self.embed_ids_file = os.path.join(memory_dir, os.path.basename(EMBED_IDS_FILE))
+        self.sources_file = os.path.join(memory_dir, os.path.basename(SOURCES_FILE))
+        self.digests_file = os.path.join(memory_dir, os.path.basename(DIGESTS_FILE))
+        self.lock_file = os.path.join(memory_dir, ".lock")
+
+    def __repr__(self):
+        return f"Workspace({self.name!r})"
+
+
+def get_workspace(name=None) -> Workspace:
+    """
+    Returns the Workspace for `name` (None means the default one), creating its
+    directories on first use. Raises ValueError for unsafe names.
+    """
+    if isinstance(name, Workspace):
+        return name
+    name = name or DEFAULT_WORKSPACE
+    if not _NAME_PATTERN.match(name):
+        raise ValueError("Workspace names may only contain letters, digits, '-' and '_'.")
+
+    if name == DEFAULT_WORKSPACE:
+        return Workspace(name, PAPERS_DIR, os.path.dirname(CHUNKS_FILE))
+
+    memory_dir = os.path.join(WORKSPACES_DIR, name)
+    papers_dir = os.path.join(PAPERS_DIR, name)
+    os.makedirs(memory_dir, exist_ok=True)
+    os.makedirs(papers_dir, exist_ok=True)
+    return Workspace(name, papers_dir, memory_dir)
+
+
+def list_workspaces() -> list[str]:
+    """Names of the default workspace and every workspace created so far."""
+    names = [DEFAULT_WORKSPACE]
+    if os.path.isdir(WORKSPACES_DIR):
+        names += sorted(
+            n for n in os.listdir(WORKSPACES_DIR)
+            if n != DEFAULT_WORKSPACE and _NAME_PATTERN.match(n)
+            and os.path.isdir(os.path.join(WORKSPACES_DIR, n))
+        )
+    return names
+
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+_held = {}  # lock file -> [open file, depth]; only touched by the thread holding that file's RLock
+
+
+def workspace_lock(workspace=None):
+    """
+    Exclusive lock on a workspace's corpus files, held around every
+    read-modify-write of chunks, manifest, digests and embeddings. It is an
+    advisory flock on the workspace's .lock file, so the app, query_server and
+    watch_indexer processes exclude each other; it is reentrant within a thread.
+    """
+    return file_lock(get_workspace(workspace).lock_file)
+
+
+@contextmanager
+def file_lock(path):
+    """Reentrant exclusive lock on `path` across threads and processes (see workspace_lock)."""
+    with _thread_locks_guard:
+        thread_lock = _thread_locks.setdefault(path, threading.RLock())
+    with thread_lock:
+        held = _held.get(path)
+        if held is None:
+            f = open(path, "a+")
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            held = _held[path] = [f, 0]
+        held[1] += 1
+        try:
+            yield
+        finally:
+            held[1] -= 1
+            if held[1] == 0:
+                del _held[path]
+                held[0].close()  # releases the flock